@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+from typing import Any, List, Optional
+
+# Discord snowflakes only need to be unique here
+_ids = itertools.count(1)
+
+
+class FakeUser:
+    """Stands in for discord.User and discord.ClientUser
+
+    Args:
+        user_id: ID of the user
+        bot: Whether the user is a bot
+    """
+
+    def __init__(self, user_id: int, bot: bool = False) -> None:
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+
+    def mentioned_in(self, message: "FakeMessage") -> bool:
+        return self in message.mentions
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+class FakeSentMessage:
+    """A message sent by the bot, which it may edit or delete"""
+
+    def __init__(self, channel: "FakeChannel", content: str) -> None:
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str) -> "FakeSentMessage":
+        self.content = content
+        self.channel.record(content)
+        return self
+
+    async def delete(self) -> None:
+        self.channel.record(None)
+
+
+class FakeChannel:
+    """Stands in for a text channel and records what the bot shows in it
+
+    Args:
+        latency: Seconds every Discord API call takes
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.id = next(_ids)
+        self.latency = latency
+        self.sends = 0
+        self.edits = 0
+        self.last_content: Optional[str] = None
+        self.changed = asyncio.Event()
+
+    def record(self, content: Optional[str]) -> None:
+        self.last_content = content
+        self.changed.set()
+
+    async def send(self, content: str) -> FakeSentMessage:
+        await asyncio.sleep(self.latency)
+        self.sends += 1
+        self.record(content)
+        return FakeSentMessage(self, content)
+
+    async def typing(self) -> None:
+        await asyncio.sleep(self.latency)
+
+    async def wait_for_change(self, timeout: float) -> None:
+        """Wait until the bot sends or edits something, or the timeout"""
+        self.changed.clear()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class FakeMessage:
+    """Stands in for a discord.Message received by the bot
+
+    Args:
+        author: Who wrote the message
+        channel: Where it was written
+        content: Text of the message
+        mentions: Users mentioned in the message
+    """
+
+    def __init__(
+        self,
+        author: FakeUser,
+        channel: FakeChannel,
+        content: str,
+        mentions: Optional[List[FakeUser]] = None,
+    ) -> None:
+        self.id = next(_ids)
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions or []
+        self.guild = None
+        self.type = None
+        self.webhook_id = None
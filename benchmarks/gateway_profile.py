@@ -0,0 +1,293 @@
+"""Compare the memory and gateway event rate of the gateway profiles
+
+Runs entirely offline: synthetic gateway traffic of large guilds is parsed
+by discord.py's connection state, configured as each GATEWAY_PROFILE
+configures the bot. Discord only sends the events of the intents a bot
+requests, so each profile receives the events its intents allow: guilds
+arrive with their members and presences, as chunking at startup delivers
+them, only when the members and presences intents are set.
+
+Usage:
+    python -m benchmarks.gateway_profile --guilds 5 --members 20000
+    python -m benchmarks.gateway_profile --minutes 30 --json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import discord
+
+# Intent that makes Discord send each event type
+EVENT_INTENTS = {
+    "GUILD_CREATE": "guilds",
+    "PRESENCE_UPDATE": "presences",
+    "GUILD_MEMBER_UPDATE": "members",
+    "MESSAGE_CREATE": "guild_messages",
+    "TYPING_START": "guild_typing",
+    "MESSAGE_REACTION_ADD": "guild_reactions",
+}
+
+BOT_ID = 10**9
+TIMESTAMP = "2024-01-01T00:00:00+00:00"
+
+
+def user(user_id: int) -> Dict[str, Any]:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "global_name": None,
+        "avatar": None,
+    }
+
+
+def member(user_id: int) -> Dict[str, Any]:
+    return {
+        "user": user(user_id),
+        "roles": [],
+        "joined_at": TIMESTAMP,
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def presence(guild_id: int, user_id: int) -> Dict[str, Any]:
+    return {
+        "user": {"id": str(user_id)},
+        "guild_id": str(guild_id),
+        "status": "online",
+        "activities": [],
+        "client_status": {"desktop": "online"},
+    }
+
+
+def guild_create(
+    guild_id: int, members: List[int], online: int, intents: discord.Intents
+) -> Dict[str, Any]:
+    """GUILD_CREATE of a guild, with the members and presences it would get"""
+    cached = members if intents.members else [BOT_ID]
+    return {
+        "id": str(guild_id),
+        "name": f"guild{guild_id}",
+        "owner_id": str(members[0]),
+        "member_count": len(members),
+        "large": True,
+        "roles": [
+            {
+                "id": str(guild_id),
+                "name": "@everyone",
+                "permissions": "0",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "channels": [
+            {"id": str(guild_id + 1), "type": 0, "name": "general", "position": 0}
+        ],
+        "members": [member(user_id) for user_id in cached],
+        "presences": (
+            [presence(guild_id, user_id) for user_id in members[:online]]
+            if intents.presences
+            else []
+        ),
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "threads": [],
+        "voice_states": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+    }
+
+
+def traffic(
+    args: argparse.Namespace, guilds: List[Tuple[int, List[int]]]
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Events of ``args.minutes`` minutes of activity in every guild"""
+    message_ids = itertools.count(BOT_ID + 1)
+    online = int(args.members * args.online)
+    for minute in range(args.minutes):
+        for guild_id, members in guilds:
+            channel_id = str(guild_id + 1)
+            for i in range(int(online * args.presence_per_minute)):
+                user_id = members[(minute * 7919 + i) % online]
+                yield "PRESENCE_UPDATE", presence(guild_id, user_id)
+            for i in range(int(args.members * args.member_updates_per_minute)):
+                user_id = members[(minute * 104729 + i) % len(members)]
+                update = {"guild_id": str(guild_id), **member(user_id)}
+                yield "GUILD_MEMBER_UPDATE", update
+            for i in range(args.messages_per_minute):
+                user_id = members[(minute * 31 + i) % online]
+                yield "TYPING_START", {
+                    "channel_id": channel_id,
+                    "guild_id": str(guild_id),
+                    "user_id": str(user_id),
+                    "timestamp": 0,
+                    "member": member(user_id),
+                }
+                message_id = str(next(message_ids))
+                yield "MESSAGE_CREATE", {
+                    "id": message_id,
+                    "channel_id": channel_id,
+                    "guild_id": str(guild_id),
+                    "author": user(user_id),
+                    "member": {k: v for k, v in member(user_id).items() if k != "user"},
+                    "content": "hello everyone",
+                    "timestamp": TIMESTAMP,
+                    "edited_timestamp": None,
+                    "tts": False,
+                    "mention_everyone": False,
+                    "mentions": [],
+                    "mention_roles": [],
+                    "attachments": [],
+                    "embeds": [],
+                    "pinned": False,
+                    "type": 0,
+                }
+                if i % 5 == 0:
+                    yield "MESSAGE_REACTION_ADD", {
+                        "user_id": str(user_id),
+                        "channel_id": channel_id,
+                        "message_id": message_id,
+                        "guild_id": str(guild_id),
+                        "emoji": {"id": None, "name": "👍"},
+                        "type": 0,
+                        "burst": False,
+                    }
+
+
+async def measure(profile: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Feed the traffic to a connection state configured for a profile"""
+    from discord.ext import commands
+
+    from discord_bot.gateway import gateway_options
+
+    options = gateway_options(profile)
+    # Members come with GUILD_CREATE here, nothing is requested from Discord
+    options["chunk_guilds_at_startup"] = False
+    bot = commands.Bot(command_prefix="!", **options)
+    state = bot._connection
+    intents = state._intents
+    state.dispatch = lambda *args, **kwargs: None  # Parsing and caching only
+
+    user_ids = itertools.count(1)
+    guilds = [
+        (BOT_ID * (index + 2), [next(user_ids) for _ in range(args.members)] + [BOT_ID])
+        for index in range(args.guilds)
+    ]
+    online = int(args.members * args.online)
+
+    events: Counter = Counter()
+    payload_bytes = 0
+
+    def deliver(event: str, data: Dict[str, Any]) -> None:
+        nonlocal payload_bytes
+        if not getattr(intents, EVENT_INTENTS[event]):
+            return  # Not sent by Discord
+        events[event] += 1
+        payload_bytes += len(json.dumps(data))
+        state.parsers[event](data)
+
+    tracemalloc.start()
+    started = time.process_time()
+    for guild_id, members in guilds:
+        deliver("GUILD_CREATE", guild_create(guild_id, members, online, intents))
+    for event, data in traffic(args, guilds):
+        deliver(event, data)
+    cpu = time.process_time() - started
+    heap, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = args.minutes * 60
+    live = sum(count for event, count in events.items() if event != "GUILD_CREATE")
+    return {
+        "profile": profile,
+        "events": dict(events),
+        "events_per_second": live / seconds,
+        "payload_kb_per_second": payload_bytes / 1024 / seconds,
+        "cpu_seconds": cpu,
+        "members": sum(len(guild.members) for guild in state.guilds),
+        "users": len(state._users),
+        "messages": len(state._messages or ()),
+        "heap_mb": heap / 2**20,
+    }
+
+
+def print_report(reports: List[Dict[str, Any]]) -> None:
+    columns = [
+        ("events/s", "events_per_second", ".1f"),
+        ("KB/s", "payload_kb_per_second", ".1f"),
+        ("cpu (s)", "cpu_seconds", ".2f"),
+        ("members", "members", "d"),
+        ("users", "users", "d"),
+        ("messages", "messages", "d"),
+        ("heap (MB)", "heap_mb", ".1f"),
+    ]
+    print(f"{'profile':<10}" + "".join(f"{title:>11}" for title, _, _ in columns))
+    for report in reports:
+        print(
+            f"{report['profile']:<10}"
+            + "".join(f"{report[key]:>11{spec}}" for _, key, spec in columns)
+        )
+    for report in reports:
+        print(f"{report['profile']} events: {report['events']}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=3, help="Guilds of the bot")
+    parser.add_argument(
+        "--members", type=int, default=20000, help="Members of each guild"
+    )
+    parser.add_argument(
+        "--online", type=float, default=0.2, help="Share of members online"
+    )
+    parser.add_argument(
+        "--minutes", type=int, default=10, help="Minutes of traffic to simulate"
+    )
+    parser.add_argument(
+        "--presence-per-minute",
+        type=float,
+        default=0.1,
+        help="Presence updates per online member and minute",
+    )
+    parser.add_argument(
+        "--member-updates-per-minute",
+        type=float,
+        default=0.001,
+        help="Member updates per member and minute",
+    )
+    parser.add_argument(
+        "--messages-per-minute",
+        type=int,
+        default=60,
+        help="Messages per guild and minute, each preceded by a typing event",
+    )
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        default=["full", "minimal"],
+        help="GATEWAY_PROFILE values to compare",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    reports = [asyncio.run(measure(profile, args)) for profile in args.profiles]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_report(reports)
+
+
+if __name__ == "__main__":
+    main()
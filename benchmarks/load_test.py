@@ -0,0 +1,369 @@
+"""Drive the bot with simulated users against a mock Azure OpenAI endpoint
+
+Runs entirely offline: Discord objects are faked and completions come from
+benchmarks.mock_azure. Every simulated user mentions the bot, gives their
+personal details and then describes symptoms for a number of turns, waiting
+for each reply before sending the next message.
+
+Usage:
+    python -m benchmarks.load_test --users 50 --turns 5 --latency 0.5
+    python -m benchmarks.load_test --users 200 --rate-limit-rate 0.05 --json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from benchmarks.fakes import FakeChannel, FakeMessage, FakeUser
+from benchmarks.mock_azure import MockAzureOpenAI
+
+SYMPTOMS = [
+    "I have had a headache for two days",
+    "It gets worse in the evening and with bright light",
+    "I also feel a bit dizzy when I stand up",
+    "No fever, but I have been sleeping badly",
+    "Paracetamol helps for a few hours",
+    "My neck feels stiff in the morning",
+    "I drink a lot of coffee at work",
+    "It started after a long flight",
+]
+
+BOT_ID = 10**9
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile, 0 for no values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def script(index: int, turns: int) -> List[str]:
+    """Messages of one simulated user, the first one mentions the bot"""
+    return [
+        f"<@{BOT_ID}> hi",
+        f"I'm Patient{index}, 30 Male, {9000000000 + index}",
+        "I live in Chennai and work as a teacher, no family history of illness",
+    ] + [SYMPTOMS[(index + turn) % len(SYMPTOMS)] for turn in range(turns)]
+
+
+class Results:
+    """Latencies and failures of every simulated turn"""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.timeouts = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.latencies.setdefault(stage, []).append(seconds)
+
+    def all(self) -> List[float]:
+        return [value for values in self.latencies.values() for value in values]
+
+
+async def simulate_user(
+    bot: Any,
+    bot_user: FakeUser,
+    index: int,
+    args: argparse.Namespace,
+    results: Results,
+) -> None:
+    from discord_bot.memory import get_user_chat_history
+
+    user = FakeUser(index + 1)
+    channel = FakeChannel(latency=args.discord_latency)
+
+    for turn, text in enumerate(script(index, args.turns)):
+        replies = sum(
+            1
+            for role, _ in get_user_chat_history(user.id, channel.id)
+            if role == "assistant"
+        )
+        mentions = [bot_user] if text.startswith(f"<@{BOT_ID}>") else []
+
+        started = time.perf_counter()
+        await bot.on_message(FakeMessage(user, channel, text, mentions))
+        deadline = started + args.turn_timeout
+        while True:
+            history = get_user_chat_history(user.id, channel.id)
+            answers = [message for role, message in history if role == "assistant"]
+            # The reply is committed to the history first, then shown
+            if (
+                len(answers) > replies
+                and channel.last_content is not None
+                and answers[-1].strip()[:100] in channel.last_content
+            ):
+                stage = "greeting" if turn == 0 else "details" if turn < 3 else "triage"
+                results.add(stage, time.perf_counter() - started)
+                break
+            if time.perf_counter() > deadline:
+                results.timeouts += 1
+                return
+            await channel.wait_for_change(0.05)
+
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+
+def memory_report(tracing: bool) -> Dict[str, float]:
+    report = {}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        report["peak_rss_mb"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_current_mb"] = current / 2**20
+        report["traced_peak_mb"] = peak / 2**20
+    return report
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mock = MockAzureOpenAI(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_latency=args.token_latency,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    endpoint = await mock.start()
+
+    # Imported late, the parameters are read from the environment set in main()
+    from openai import AsyncAzureOpenAI
+
+    from chatbot.metrics import LLM_COST, LLM_TOKENS, ROUTE_SECONDS
+    from discord_bot.bot import create_bot
+    from discord_bot.memory import close_storage, configure_storage
+    from discord_bot.storage import SQLiteBackend
+
+    if args.sqlite:
+        configure_storage(SQLiteBackend(os.path.join(tempfile.mkdtemp(), "load.db")))
+
+    client = AsyncAzureOpenAI(
+        api_key="mock",
+        azure_endpoint=endpoint,
+        api_version="2024-10-21",
+        max_retries=0,
+    )
+    bot = create_bot(client)
+    bot_user = FakeUser(BOT_ID, bot=True)
+    bot._connection.user = bot_user
+    # Fake messages have no connection state to build a command context from,
+    # and none of the scripted messages is a command
+    bot.process_commands = lambda message: asyncio.sleep(0)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    results = Results()
+    started = time.perf_counter()
+
+    async def start_user(index: int) -> None:
+        await asyncio.sleep(args.ramp_up * index / max(args.users, 1))
+        await simulate_user(bot, bot_user, index, args, results)
+
+    await asyncio.gather(*(start_user(index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    latencies = results.all()
+    tokens: Dict[str, float] = {}
+    for _, labels, value in LLM_TOKENS.samples():
+        tokens[labels["kind"]] = tokens.get(labels["kind"], 0) + value
+    routes: Dict[str, Dict[str, float]] = {}
+    for name, labels, value in ROUTE_SECONDS.samples():
+        if name.endswith(("_sum", "_count")):
+            routes.setdefault(labels["route"], {})[name.rsplit("_", 1)[1]] = value
+    for _, labels, value in LLM_COST.samples():
+        routes.setdefault(labels["route"], {})["cost_usd"] = value
+    report = {
+        "users": args.users,
+        "turns": len(latencies),
+        "timeouts": results.timeouts,
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "llm_requests": mock.requests,
+        "llm_requests_per_second": mock.requests / elapsed if elapsed else 0.0,
+        "rate_limited": mock.rate_limited,
+        "tokens": tokens,
+        "cached_prompt_ratio": (
+            tokens.get("cached", 0) / tokens["prompt"] if tokens.get("prompt") else 0.0
+        ),
+        "routes": {
+            name: {
+                "requests": route.get("count", 0),
+                "mean_seconds": (
+                    route["sum"] / route["count"] if route.get("count") else 0.0
+                ),
+                "cost_usd": route.get("cost_usd", 0.0),
+            }
+            for name, route in routes.items()
+        },
+        "latency": {
+            stage: {
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+            for stage, values in {"all": latencies, **results.latencies}.items()
+            if values
+        },
+        "memory": memory_report(args.tracemalloc),
+    }
+
+    close_storage()
+    await client.close()
+    await mock.stop()
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"{report['users']} users, {report['turns']} turns in {report['seconds']:.1f}s"
+        f" ({report['turns_per_second']:.2f} turns/s), {report['timeouts']} timeouts"
+    )
+    print(
+        f"LLM: {report['llm_requests']} requests"
+        f" ({report['llm_requests_per_second']:.2f}/s),"
+        f" {report['rate_limited']} rate limited, tokens {report['tokens']},"
+        f" {report['cached_prompt_ratio']:.0%} of prompt tokens cached"
+    )
+    for name, route in report["routes"].items():
+        print(
+            f"route {name}: {route['requests']:.0f} requests,"
+            f" mean {route['mean_seconds']:.3f}s, ${route['cost_usd']:.4f}"
+        )
+    print(f"{'latency (s)':<12}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for stage, values in report["latency"].items():
+        print(
+            f"{stage:<12}"
+            + "".join(f"{values[key]:>8.3f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    print(
+        "memory: " + ", ".join(f"{k} {v:.1f}" for k, v in report["memory"].items())
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="Concurrent users")
+    parser.add_argument("--turns", type=int, default=4, help="Symptom turns per user")
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=1.0,
+        help="Seconds to start every user",
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="Mean seconds between a reply and the next message",
+    )
+    parser.add_argument(
+        "--turn-timeout",
+        type=float,
+        default=120.0,
+        help="Seconds before a turn counts as timed out",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Seconds before the mock answers",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.2,
+        help="Extra random seconds of mock latency",
+    )
+    parser.add_argument(
+        "--token-latency",
+        type=float,
+        default=0.01,
+        help="Seconds between streamed chunks",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with a 429",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1.0,
+        help="Retry-After of the injected 429s",
+    )
+    parser.add_argument(
+        "--discord-latency",
+        type=float,
+        default=0.0,
+        help="Seconds every Discord call takes",
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Do not stream diagnosis replies",
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        type=float,
+        default=0.0,
+        help="COALESCE_WINDOW of the bot",
+    )
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help="Use the SQLite storage backend",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Trace Python allocations, slows the run",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the mock's randomness",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # Read by the bot's parameters modules when they are first imported
+    os.environ["STREAM_RESPONSES"] = "false" if args.no_stream else "true"
+    os.environ["COALESCE_WINDOW"] = str(args.coalesce_window)
+    os.environ.setdefault("STREAM_EDIT_INTERVAL", "0.2")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    from chatbot.logs import configure_logging
+
+    configure_logging(os.environ["LOG_LEVEL"])
+    random.seed(args.seed)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
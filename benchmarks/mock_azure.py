@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+
+
+def fake_value(schema: Dict[str, Any], name: str = "") -> Any:
+    """Build a value that satisfies a JSON schema, as strict mode guarantees
+
+    Args:
+        schema: The JSON schema
+        name: Name of the property the value is for
+
+    Returns:
+        Any: The value
+    """
+    if "enum" in schema:
+        # "no" keeps yes/no flags such as diagnose_complete from ending the interview
+        return "no" if "no" in schema["enum"] else schema["enum"][0]
+    kind = schema.get("type")
+    if name == "personal_details":
+        # Triage turns rarely correct the details, keep the scripted ones
+        return {key: "" for key in schema.get("properties", {})}
+    if kind == "object":
+        return {
+            key: fake_value(value, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if kind == "array" and name in ("replace", "remove"):
+        return []  # Triage patches mostly append
+    if kind == "array":
+        return [fake_value(schema.get("items", {}), name)]
+    if kind == "integer":
+        return 50
+    if kind == "number":
+        return 0.5
+    if kind == "boolean":
+        return False
+    if name == "diagnosed_with":
+        return ""  # Keeps the interview going, like an inconclusive triage
+    if name == "Mobile":
+        return "9876543210"
+    if name == "Age":
+        return "30"
+    return f"mock {name}".strip() if name else "mock"
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockAzureOpenAI:
+    """A local stand-in for Azure OpenAI chat completions
+
+    Answers every request with content that matches its response_format,
+    after a configurable latency, optionally streamed and optionally
+    rejected with a 429.
+
+    Args:
+        latency: Seconds before the first byte of every response
+        jitter: Extra random seconds, uniform between 0 and ``jitter``
+        token_latency: Seconds between two streamed chunks
+        rate_limit_rate: Share of requests rejected with a 429
+        retry_after: Seconds the 429 responses ask to wait
+        seed: Seed of the random generator, for repeatable runs
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.2,
+        token_latency: float = 0.01,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self._prefixes: Set[bytes] = set()
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    def _content(self, body: Dict[str, Any]) -> str:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            return json.dumps(fake_value(schema))
+        if response_format.get("type") == "json_object":
+            return json.dumps({"result": "mock"})
+        return "mock summary of the conversation"
+
+    def _usage(self, body: Dict[str, Any], content: str) -> Dict[str, Any]:
+        # A structured output schema is a prefix of the system message
+        prompt = json.dumps(body.get("response_format")) + json.dumps(
+            body.get("messages", [])
+        )
+        prompt_tokens = _count_tokens(prompt)
+
+        # Azure caches prompt prefixes of 1024 tokens and more in 128 token
+        # steps, the longest prefix seen before is served from the cache
+        cached_tokens = 0
+        for tokens in range(1024, prompt_tokens + 1, 128):
+            key = hashlib.sha256(prompt[: tokens * 4].encode()).digest()
+            if key in self._prefixes:
+                cached_tokens = tokens
+            else:
+                self._prefixes.add(key)
+
+        completion_tokens = _count_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if self.random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                status=429,
+                headers={"retry-after-ms": str(int(self.retry_after * 1000))},
+            )
+
+        content = self._content(body)
+        usage = self._usage(body, content)
+        common = {
+            "id": f"chatcmpl-{self.requests}",
+            "created": int(time.time()),
+            "model": request.match_info["deployment"],
+        }
+
+        if not body.get("stream"):
+            return web.json_response(
+                {
+                    **common,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content},
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(chunk: Dict[str, Any]) -> None:
+            payload = {**common, "object": "chat.completion.chunk", **chunk}
+            await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+
+        for start in range(0, len(content), 4):  # About one token per chunk
+            await send(
+                {
+                    "choices": [
+                        {"index": 0, "delta": {"content": content[start : start + 4]}}
+                    ]
+                }
+            )
+            await asyncio.sleep(self.token_latency)
+        await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({"choices": [], "usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 for any free port
+
+        Returns:
+            str: The endpoint to pass as azure_endpoint
+        """
+        app = web.Application()
+        app.router.add_post(
+            "/openai/deployments/{deployment}/chat/completions", self._chat_completions
+        )
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        """Stop serving"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+
+class CacheBackend:
+    """Interface of the stores behind CompletionCache, values are strings"""
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a value that has not expired, None otherwise"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        """Store a value for ``ttl`` seconds, evicting the least recently used"""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Drop every value"""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Size-bounded LRU dictionary with per-entry expiry
+
+    Args:
+        max_size (int): Maximum number of entries
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class DiskCacheBackend(CacheBackend):
+    """LRU cache with per-entry expiry stored in SQLite, so hits survive restarts
+
+    Args:
+        path (str): Path of the database file
+        max_size (int): Maximum number of entries
+    """
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )"""
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)"
+        )
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            self._connection.execute(
+                "UPDATE completions SET used_at = ? WHERE key = ?", (now, key)
+            )
+        return row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now),
+            )
+            self._connection.execute(
+                """DELETE FROM completions WHERE key IN (
+                    SELECT key FROM completions ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_size,),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM completions")
+
+
+class CompletionCache:
+    """Cache of chat completions keyed on the normalized request
+
+    Args:
+        backend (CacheBackend): Where the completions are kept
+        ttl (float): Seconds a completion stays valid
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(params: Dict[str, Any]) -> str:
+        """Hash the model, messages and generation parameters of a request
+
+        Whitespace around message contents is ignored, so prompts built from
+        indented f-strings hash the same regardless of formatting.
+
+        Args:
+            params (Dict[str, Any]): Arguments of chat.completions.create
+
+        Returns:
+            str: The cache key
+        """
+        normalized = dict(params)
+        normalized["messages"] = [
+            {**message, "content": " ".join(str(message.get("content", "")).split())}
+            for message in params.get("messages", [])
+        ]
+        payload = json.dumps(normalized, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, params: Dict[str, Any]) -> Optional[ChatCompletion]:
+        """Get the cached completion of a request
+
+        Args:
+            params (Dict[str, Any]): Arguments of chat.completions.create
+
+        Returns:
+            Optional[ChatCompletion]: The completion, None on a miss
+        """
+        value = self.backend.get(self.key(params))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ChatCompletion.model_validate_json(value)
+
+    def set(self, params: Dict[str, Any], completion: ChatCompletion) -> None:
+        """Cache the completion of a request
+
+        Args:
+            params (Dict[str, Any]): Arguments of chat.completions.create
+            completion (ChatCompletion): The completion
+        """
+        self.backend.set(self.key(params), completion.model_dump_json(), self.ttl)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counters of the cache
+
+        Returns:
+            Dict[str, float]: hits, misses and hit_ratio
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
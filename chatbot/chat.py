@@ -1,10 +1,32 @@
 import os
-from typing import Dict, Tuple, List
-from openai import AzureOpenAI
+from typing import Awaitable, Callable, Dict, Optional, Tuple, List
+from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
 import json
-import re
-from typing import Dict, Tuple
+
+from chatbot.completions import create_completion
+from chatbot.extraction import (
+    PERSONAL_DETAILS_FIELDS,
+    TRIAGE_SCHEMA,
+    Diagnosis,
+    DiagnosisPatch,
+    PersonalDetails,
+    Triage,
+    extract_json,
+    parse_json,
+    personal_details_schema,
+    repair_json,
+    response_format,
+)
+from chatbot.local_parser import parse_personal_details
+from chatbot.logs import payload_logger
+from chatbot.metrics import STAGE_SECONDS
+from chatbot.prompts import (
+    diagnosis_messages,
+    doctor_report_messages,
+    personal_details_parse_messages,
+)
+from chatbot.scheduler import Priority
 
 load_dotenv()
 
@@ -20,10 +42,12 @@ load_dotenv()
 # else:
 
 
-def hello(client) -> str:
+async def hello(client: AsyncAzureOpenAI) -> str:
 
-    response = client.chat.completions.create(
-        model="gpt-4o",  # model = "deployment_name".
+    response = await create_completion(
+        client,
+        task="greeting",
+        priority=Priority.BACKGROUND,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
             {
@@ -38,224 +62,273 @@ def hello(client) -> str:
     return response.choices[0].message.content
 
 
-def personal_parser(client, user_message: str) -> Tuple[Dict[str, str], str]:
-    response = (
-        client.chat.completions.create(
-            model="gpt-4o",  # model = "deployment_name".
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant. Your task is to parse the given user response into a json format with the fields 1. Name, 2. Age, 3. Mobile, 4. Gender, 5. Address, 6. Occupation and 7. Family History. If you didn't find any of them in the users prompt leave those feilds empty.",
-                },
-                {
-                    "role": "user",
-                    "content": user_message,
-                },
-            ],
-        )
-        .choices[0]
-        .message.content
+def _personal_details_reply(data: Dict[str, str]) -> str:
+    """Ask for the missing personal details, or move on to the symptoms"""
+    missing_fields = [field for field, value in data.items() if not value]
+
+    if missing_fields:
+        return f"Please provide your {' and '.join(missing_fields)}."
+
+    return """Thank you for providing all your personal details! 
+    Now, I'll help you with your medical concerns. Let's start with a detailed assessment of your symptoms.
+    Please tell me:
+    1. What is your main symptom or concern?
+    2. When did it first start?
+    3. How severe is it on a scale of 1-10?
+    4. Is it constant or does it come and go?
+    5. Have you noticed any triggers that make it worse?
+    Please provide as much detail as possible about your symptoms.
+    """
+
+
+async def personal_parser(
+    client: AsyncAzureOpenAI, user_message: str
+) -> Tuple[PersonalDetails, str]:
+    # Pull the common details out locally and only ask the model for the rest
+    local_data, remainder = parse_personal_details(user_message)
+    missing_fields = [
+        field for field in PERSONAL_DETAILS_FIELDS if field not in local_data
+    ]
+
+    if not remainder or not missing_fields:
+        # Nothing left in the message for the model to find
+        data = {field: local_data.get(field, "") for field in PERSONAL_DETAILS_FIELDS}
+        return data, _personal_details_reply(data)
+
+    model_data = await extract_json(
+        client,
+        personal_details_parse_messages(user_message),
+        personal_details_schema(missing_fields),
+        task="personal_details",
+        priority=Priority.ONBOARDING,
     )
 
-    print(response)
-
-    match = re.search(r"```json(.*?)```", response, re.DOTALL)
-    if match:
-        json_response = match.group(1)
-        try:
-            data = json.loads(json_response)
-            missing_fields = [field for field, value in data.items() if not value]
-
-            if data is None:
-                reply = "I couldn't parse your details. Please try again with the format: I'm [Name], [Age] [Gender]. I'm currently working as [Occupation] at [Company]."
-            elif missing_fields:
-                reply = f"Please provide your {' and '.join(missing_fields)}."
-            else:
-                reply = """Thank you for providing all your personal details! 
-                Now, I'll help you with your medical concerns. Let's start with a detailed assessment of your symptoms.
-                Please tell me:
-                1. What is your main symptom or concern?
-                2. When did it first start?
-                3. How severe is it on a scale of 1-10?
-                4. Is it constant or does it come and go?
-                5. Have you noticed any triggers that make it worse?
-                Please provide as much detail as possible about your symptoms.
-                """
-            return data, reply
-        except json.JSONDecodeError as e:
-            return {}, f"Error: {e}"
-    return {}, response
-
-
-def update_personal_details(
-    client,
+    payload_logger.debug("personal details response: %s", model_data)
+
+    if model_data is None:
+        return (
+            {},
+            "I couldn't parse your details. Please try again with the format: I'm [Name], [Age] [Gender]. I'm currently working as [Occupation] at [Company].",
+        )
+    data = {
+        field: local_data.get(field) or model_data.get(field, "")
+        for field in PERSONAL_DETAILS_FIELDS
+    }
+    return data, _personal_details_reply(data)
+
+
+def _diagnosis_reply(
+    triage: Optional[Triage], medical_data: Diagnosis
+) -> Tuple[DiagnosisPatch, Dict[str, str], str]:
+    """Split a triage response into the diagnosis patch, the details and the reply"""
+    if triage is None:
+        return (
+            {},
+            {},
+            "I couldn't understand your symptoms. Could you please describe them again?",
+        )
+
+    details = triage.pop("personal_details", None) or {}
+    # Empty fields carry no update
+    details = {field: value for field, value in details.items() if value}
+    patch: DiagnosisPatch = triage
+
+    if patch.get("diagnose_complete", "").lower() == "no":
+        return (
+            patch,
+            details,
+            patch.get(
+                "next_question",
+                "Could you please describe your symptoms in more detail?",
+            ),
+        )
+    else:
+        # Left empty when an earlier turn already set it
+        diagnosed_with = patch.get("diagnosed_with") or medical_data.get(
+            "diagnosed_with", ""
+        )
+        return (
+            patch,
+            details,
+            f"Based on your symptoms, you may be experiencing: {diagnosed_with}. Would you like to know more about this condition?",
+        )
+
+
+def _partial_field(response: str, field: str) -> Tuple[str, bool]:
+    """Read the string value of a field from a JSON response that is still streaming
+
+    Args:
+        response: The response received so far
+        field: Name of a string field
+
+    Returns:
+        Tuple containing the part of the value received so far, empty if it
+        has not started, and whether the value is complete
+    """
+    start = response.find(f'"{field}"')
+    if start < 0:
+        return "", False
+    colon = response.find(":", start + len(field) + 2)
+    start = response.find('"', colon) if colon >= 0 else -1
+    if start < 0:
+        return "", False
+
+    value = []
+    index = start + 1
+    while index < len(response):
+        char = response[index]
+        if char == '"':
+            return "".join(value), True
+        if char == "\\":
+            escape = response[index : index + 2]
+            if len(escape) < 2:  # The escape sequence is cut off by the chunk
+                break
+            if escape[1] == "u":
+                escape = response[index : index + 6]
+                if len(escape) < 6:
+                    break
+            value.append(json.loads(f'"{escape}"'))
+            index += len(escape)
+            continue
+        value.append(char)
+        index += 1
+
+    return "".join(value), False
+
+
+async def check_diagnosis(
+    client: AsyncAzureOpenAI,
     user_message: str,
-    previous_data: Dict[str, str],
     chat_history: List[Tuple[str, str]],
-) -> Tuple[Dict[str, str], str]:
-    """Update user's personal details with new information from the message.
+    user_data: Dict[str, str],
+    summary: str = "",
+    medical_data: Optional[Diagnosis] = None,
+) -> Tuple[DiagnosisPatch, Dict[str, str], str]:
+    """Check and diagnose medical symptoms based on user's input.
+
+    The same request picks up personal details the message provides or
+    corrects, so they need no separate call.
 
     Args:
-        client: OpenAI client
-        user_message: New message from user
-        previous_data: Previously collected user data
-        chat_history: List of previous conversation messages
+        client: Async Azure OpenAI client
+        user_message: User's message about their symptoms
+        chat_history: Previous (role, message) turns of this user
+        user_data: User's personal information
+        summary: Rolling summary of the turns that no longer fit the context
+        medical_data: The stored diagnosis, which the response patches
 
     Returns:
-        Tuple containing updated data and response message
+        Tuple containing the changes to the diagnosis, the personal details
+        to update and response message
     """
-    # Format chat history for context
-    context = "\n".join([f"{role}: {msg}" for role, msg in chat_history])
-
-    print(f"chat context: {context}")
-
-    response = (
-        client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""You are a helpful assistant. Your task is to update the user's personal details.
-                    Previous data: {json.dumps(previous_data)}
-                    Chat history: {context}
-                    Update the following fields if new information is provided: Name, Age, Mobile, Gender, Address, Occupation, Family History.
-                    Return only the updated fields in JSON format.""",
-                },
-                {
-                    "role": "user",
-                    "content": user_message,
-                },
-            ],
-        )
-        .choices[0]
-        .message.content
+    triage = await extract_json(
+        client,
+        diagnosis_messages(
+            user_message, user_data, chat_history, summary, medical_data
+        ),
+        TRIAGE_SCHEMA,
+        task="triage",
+        use_cache=False,  # Every turn of an interview needs a fresh answer
     )
 
-    print("update personal response: {response}")
+    return _diagnosis_reply(triage, medical_data or {})
 
-    try:
-        # Extract JSON from response
-        match = re.search(r"```json(.*?)```", response, re.DOTALL)
-        if match:
-            new_data = json.loads(match.group(1))
-            # Merge new data with previous data
-            updated_data = {**previous_data, **new_data}
-
-            # Check for missing fields
-            missing_fields = [
-                field for field, value in updated_data.items() if not value
-            ]
-
-            if missing_fields:
-                reply = f"Please provide your {' and '.join(missing_fields)}."
-            else:
-                reply = """Thank you for providing all your personal details! 
-                Now, I'll help you with your medical concerns. Let's start with a detailed assessment of your symptoms.
-                Please tell me:
-                1. What is your main symptom or concern?
-                2. When did it first start?
-                3. How severe is it on a scale of 1-10?
-                4. Is it constant or does it come and go?
-                5. Have you noticed any triggers that make it worse?
-                Please provide as much detail as possible about your symptoms.
-                """
-
-            return updated_data, reply
-    except (json.JSONDecodeError, AttributeError) as e:
-        return previous_data, f"Error parsing response: {str(e)}"
-
-    return previous_data, "I couldn't understand your response. Please try again."
-
-
-def check_diagnosis(
-    client,
+
+async def stream_diagnosis(
+    client: AsyncAzureOpenAI,
     user_message: str,
     chat_history: List[Tuple[str, str]],
     user_data: Dict[str, str],
-) -> Tuple[Dict[str, str], str]:
-    """Check and diagnose medical symptoms based on user's input.
+    on_progress: Callable[[str], Awaitable[None]],
+    summary: str = "",
+    medical_data: Optional[Diagnosis] = None,
+) -> Tuple[DiagnosisPatch, Dict[str, str], str]:
+    """Streaming variant of check_diagnosis.
+
+    The next question is passed to ``on_progress`` as it is generated, so the
+    user sees it while the rest of the diagnosis JSON is still being written.
 
     Args:
-        client: OpenAI client
+        client: Async Azure OpenAI client
         user_message: User's message about their symptoms
-        chat_history: List of previous conversation messages
+        chat_history: Previous (role, message) turns of this user
         user_data: User's personal information
+        on_progress: Called with the next question received so far
+        summary: Rolling summary of the turns that no longer fit the context
+        medical_data: The stored diagnosis, which the response patches
 
     Returns:
-        Tuple containing diagnosis data and response message
+        Tuple containing the changes to the diagnosis, the personal details
+        to update and response message
     """
-    context = "\n".join([f"{role}: {msg}" for role, msg in chat_history])
-
-    response = (
-        client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""You are a thorough medical assistant conducting a detailed patient interview. 
-                    Your task is to systematically gather information and prepare a detailed medical report for the doctor.
-                    
-                    Patient Information: {json.dumps(user_data)}
-                    Chat history: {context}
-                    
-                    Follow this structured approach:
-                    1. First, identify and confirm all reported symptoms
-                    2. For each symptom, ask about:
-                       - Onset (when it started)
-                       - Duration (how long it lasts)
-                       - Frequency (how often it occurs)
-                       - Severity (on a scale of 1-10)
-                       - Triggers (what makes it worse)
-                       - Alleviating factors (what makes it better)
-                    3. Ask about associated symptoms
-                    4. Inquire about medical history, medications, and allergies
-                    5. Consider lifestyle factors and recent changes
-                    6. Specifically ask about family history related to current symptoms
-                    
-                    Return a JSON response with fields:
-                    1. diagnose_complete (yes/no)
-                    2. symptoms (detailed list of identified symptoms with their characteristics)
-                    3. possible_diagnoses (list of potential diagnoses in order of likelihood)
-                    4. confidence_level (percentage for each diagnosis)
-                    5. next_question (specific question to narrow down the diagnosis)
-                    6. red_flags (any concerning symptoms that need immediate attention)
-                    7. can_diagnose (yes/no - whether enough information is available for a diagnosis)
-                    8. doctor_summary (detailed summary for the doctor)
-                    9. family_history_related (yes/no - whether there is family history related to current symptoms)
-                    """,
-                },
-                {
-                    "role": "user",
-                    "content": user_message,
-                },
-            ],
-        )
-        .choices[0]
-        .message.content
+    messages = diagnosis_messages(
+        user_message, user_data, chat_history, summary, medical_data
+    )
+    stream = await create_completion(
+        client,
+        task="triage",
+        messages=messages,
+        response_format=response_format(TRIAGE_SCHEMA),
+        stream=True,
     )
 
+    response = ""
+    question = ""
+    question_complete = False
+    with STAGE_SECONDS.time(stage="stream"):
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue  # Azure sends content filter results in chunks without text
+            response += chunk.choices[0].delta.content
+            if question_complete:
+                continue  # The rest of the diagnosis is only read once it is complete
+            partial_question, question_complete = _partial_field(
+                response, "next_question"
+            )
+            if partial_question != question:
+                question = partial_question
+                await on_progress(question)
+
     try:
-        match = re.search(r"```json(.*?)```", response, re.DOTALL)
-        if match:
-            medical_data = json.loads(match.group(1))
-
-            if medical_data.get("diagnose_complete", "").lower() == "no":
-                return medical_data, medical_data.get(
-                    "next_question",
-                    "Could you please describe your symptoms in more detail?",
-                )
-            else:
-                return (
-                    medical_data,
-                    f"Based on your symptoms, you may be experiencing: {medical_data.get('diagnosed_with', '')}. Would you like to know more about this condition?",
-                )
-    except (json.JSONDecodeError, AttributeError) as e:
-        return {}, f"Error parsing response: {str(e)}"
-
-    return (
-        {},
-        "I couldn't understand your symptoms. Could you please describe them again?",
+        with STAGE_SECONDS.time(stage="parse"):
+            triage = parse_json(response)
+    except ValueError as e:
+        triage = await repair_json(
+            client, messages, response, e, TRIAGE_SCHEMA, "triage", Priority.TRIAGE
+        )
+
+    return _diagnosis_reply(triage, medical_data or {})
+
+
+async def write_doctor_report(
+    client: AsyncAzureOpenAI,
+    user_data: Dict[str, str],
+    medical_data: Diagnosis,
+    chat_history: List[Tuple[str, str]],
+    summary: str = "",
+) -> str:
+    """Write the report a doctor reads once the triage is complete.
+
+    Nobody waits on it, so it is requested at background priority.
+
+    Args:
+        client: Async Azure OpenAI client
+        user_data: User's personal information
+        medical_data: The stored diagnosis
+        chat_history: (role, message) turns of the interview
+        summary: Rolling summary of the turns that no longer fit the context
+
+    Returns:
+        The report
+    """
+    completion = await create_completion(
+        client,
+        task="doctor_report",
+        use_cache=False,  # The report follows the latest data
+        priority=Priority.BACKGROUND,
+        messages=doctor_report_messages(user_data, medical_data, chat_history, summary),
     )
+    return completion.choices[0].message.content or ""
 
 
 # def generate_differential_diagnosis() -> Tuple[List[str], str]:
@@ -0,0 +1,116 @@
+from typing import Any, AsyncIterator, Optional
+
+from openai import AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion
+
+from chatbot.cache import (
+    CompletionCache,
+    DiskCacheBackend,
+    MemoryCacheBackend,
+)
+from chatbot.metrics import LLM_REQUESTS, QUEUED_REQUESTS, ROUTE_SECONDS, STAGE_SECONDS
+from chatbot.parameters import (
+    AZURE_REQUESTS_PER_MINUTE,
+    AZURE_TOKENS_PER_MINUTE,
+    COMPLETION_CACHE,
+    COMPLETION_CACHE_FILE,
+    COMPLETION_CACHE_SIZE,
+    COMPLETION_CACHE_TTL,
+    COMPLETION_TOKENS_ESTIMATE,
+    RATE_LIMIT_MAX_RETRIES,
+)
+from chatbot.routing import route
+from chatbot.scheduler import Priority, RequestScheduler
+from chatbot.tokens import count_message_tokens
+
+
+def _create_cache() -> Optional[CompletionCache]:
+    """Build the completion cache selected by COMPLETION_CACHE"""
+    if COMPLETION_CACHE == "memory":
+        backend = MemoryCacheBackend(COMPLETION_CACHE_SIZE)
+    elif COMPLETION_CACHE == "disk":
+        backend = DiskCacheBackend(COMPLETION_CACHE_FILE, COMPLETION_CACHE_SIZE)
+    else:
+        return None
+    return CompletionCache(backend, COMPLETION_CACHE_TTL)
+
+
+# Shared by every call site, None when caching is turned off
+completion_cache = _create_cache()
+
+# Admission control shared by every call site
+request_scheduler = RequestScheduler(
+    AZURE_REQUESTS_PER_MINUTE, AZURE_TOKENS_PER_MINUTE, RATE_LIMIT_MAX_RETRIES
+)
+QUEUED_REQUESTS.set_function(lambda: request_scheduler.stats()["queue_depth"])
+
+
+async def _settled(
+    stream: AsyncIterator[Any], task_route: Any, estimated_tokens: float
+) -> AsyncIterator[Any]:
+    """Pass the chunks of a stream through, settling the usage of the last one"""
+    async for chunk in stream:
+        if chunk.usage is not None:
+            task_route.record(chunk.usage)
+            request_scheduler.settle(estimated_tokens, chunk.usage)
+        yield chunk
+
+
+async def create_completion(
+    client: AsyncAzureOpenAI,
+    task: str = "triage",
+    use_cache: bool = True,
+    priority: Priority = Priority.TRIAGE,
+    **params: Any,
+) -> Any:
+    """Create a chat completion, the single entry point for every LLM call
+
+    The route of the task picks the model and the generation settings.
+
+    Args:
+        client: Async Azure OpenAI client
+        task: What the request is for, a key of the routing table
+        use_cache: Whether an identical earlier request may answer this one,
+            call sites whose answers must be fresh pass False
+        priority: Admission order of the request when the quotas are tight
+        **params: Arguments of chat.completions.create, they take precedence
+            over the route's settings
+
+    Returns:
+        The completion, or the chunk stream when ``stream=True``
+    """
+    task_route = route(task)
+    params = task_route.params(**params)
+    if params.get("stream"):
+        # Usage comes alone in the last chunk, it settles the token budget
+        params.setdefault("stream_options", {"include_usage": True})
+    use_cache = use_cache and completion_cache is not None and not params.get("stream")
+
+    if use_cache:
+        cached = completion_cache.get(params)
+        if cached is not None:
+            LLM_REQUESTS.inc(outcome="cached")
+            return cached
+
+    estimated_tokens = count_message_tokens(params["messages"]) + params.get(
+        "max_tokens", COMPLETION_TOKENS_ESTIMATE
+    )
+
+    async def request() -> Any:
+        with STAGE_SECONDS.time(stage="llm"), ROUTE_SECONDS.time(route=task):
+            return await client.chat.completions.create(**params)
+
+    try:
+        completion = await request_scheduler.run(request, priority, estimated_tokens)
+    except Exception as e:
+        LLM_REQUESTS.inc(outcome=type(e).__name__)
+        raise
+    LLM_REQUESTS.inc(outcome="ok")
+    if params.get("stream"):
+        return _settled(completion, task_route, estimated_tokens)
+    if isinstance(completion, ChatCompletion) and completion.usage is not None:
+        task_route.record(completion.usage)
+
+    if use_cache and isinstance(completion, ChatCompletion):
+        completion_cache.set(params, completion)
+    return completion
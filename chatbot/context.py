@@ -0,0 +1,119 @@
+from typing import List, Tuple
+
+from openai import AsyncAzureOpenAI
+
+from chatbot.completions import create_completion
+from chatbot.parameters import CONTEXT_TOKEN_BUDGET, SUMMARY_MAX_TOKENS
+from chatbot.scheduler import Priority
+from chatbot.tokens import count_tokens
+
+
+def format_turn(role: str, message: str) -> str:
+    """Format a single chat turn the way it appears in the prompt"""
+    return f"{role}: {message}"
+
+
+def split_history(
+    chat_history: List[Tuple[str, str]], budget: int
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """Split the chat history into older turns and the newest turns within a budget
+
+    Args:
+        chat_history: (role, message) turns, oldest first
+        budget: Token budget for the newest turns
+
+    Returns:
+        Tuple containing the older turns that do not fit and the recent turns
+        that do
+    """
+    used = 0
+    start = len(chat_history)
+    for index in range(len(chat_history) - 1, -1, -1):
+        used += count_tokens(format_turn(*chat_history[index]))
+        if used > budget:
+            break
+        start = index
+
+    return chat_history[:start], chat_history[start:]
+
+
+def format_context(chat_history: List[Tuple[str, str]], summary: str = "") -> str:
+    """Format the summary and recent turns into the chat context of a prompt
+
+    Args:
+        chat_history: Recent (role, message) turns
+        summary: Summary of the older turns
+
+    Returns:
+        The chat context
+    """
+    context = "\n".join([format_turn(role, msg) for role, msg in chat_history])
+    if summary:
+        context = f"Summary of earlier conversation: {summary}\n{context}"
+    return context
+
+
+async def summarize_turns(
+    client: AsyncAzureOpenAI, summary: str, turns: List[Tuple[str, str]]
+) -> str:
+    """Fold older turns into the running summary of a conversation
+
+    Args:
+        client: Async Azure OpenAI client
+        summary: The current summary, empty for a new conversation
+        turns: The (role, message) turns to fold in
+
+    Returns:
+        The updated summary
+    """
+    completion = await create_completion(
+        client,
+        task="summary",
+        priority=Priority.DETAILS,
+        messages=[
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a medical intake conversation. "
+                "Merge the new turns into the existing summary. Keep every symptom, "
+                "date, severity, medication, allergy and personal detail, drop small talk, "
+                f"and keep the summary under {SUMMARY_MAX_TOKENS} tokens. Reply with the summary only.",
+            },
+            {
+                "role": "user",
+                "content": f"Existing summary: {summary or 'None'}\n"
+                f"New turns:\n{format_context(turns)}",
+            },
+        ],
+    )
+    return completion.choices[0].message.content or summary
+
+
+async def build_context(
+    client: AsyncAzureOpenAI,
+    chat_history: List[Tuple[str, str]],
+    summary: str = "",
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[Tuple[str, str]], str, int]:
+    """Keep the newest turns within the token budget and summarize the rest
+
+    Once the history overflows the budget, everything but the newest half of
+    the budget is folded into the summary in one call, so the summarization
+    cost is paid every few turns rather than on every turn.
+
+    Args:
+        client: Async Azure OpenAI client
+        chat_history: (role, message) turns of the user, oldest first
+        summary: The current summary of the user's conversation
+        budget: Token budget for the verbatim turns
+
+    Returns:
+        Tuple containing the recent turns, the updated summary and the number
+        of oldest turns that were folded into the summary
+    """
+    older, recent = split_history(chat_history, budget)
+    if not older:
+        return recent, summary, 0
+
+    older, recent = split_history(chat_history, budget // 2)
+    summary = await summarize_turns(client, summary, older)
+    return recent, summary, len(older)
@@ -0,0 +1,274 @@
+import json
+from typing import Any, Dict, List, Literal, Optional, TypedDict
+
+from openai import AsyncAzureOpenAI
+
+from chatbot.completions import create_completion
+from chatbot.metrics import STAGE_SECONDS
+from chatbot.scheduler import Priority
+
+PersonalDetails = TypedDict(
+    "PersonalDetails",
+    {
+        "Name": str,
+        "Age": str,
+        "Mobile": str,
+        "Gender": str,
+        "Address": str,
+        "Occupation": str,
+        "Family History": str,
+    },
+)
+
+
+class DiagnosisConfidence(TypedDict):
+    diagnosis: str
+    confidence: int  # Percentage
+
+
+class Diagnosis(TypedDict):
+    next_question: str
+    diagnose_complete: Literal["yes", "no"]
+    symptoms: List[str]
+    possible_diagnoses: List[str]
+    confidence_level: List[DiagnosisConfidence]
+    red_flags: List[str]
+    can_diagnose: Literal["yes", "no"]
+    diagnosed_with: str
+    family_history_related: Literal["yes", "no"]
+
+
+class ListReplacement(TypedDict):
+    index: int  # Position in the stored list
+    value: Any
+
+
+class ListPatch(TypedDict):
+    append: List[Any]
+    replace: List[ListReplacement]
+    remove: List[int]  # Positions in the stored list
+
+
+class DiagnosisPatch(TypedDict):
+    """The changes a triage turn makes to the stored Diagnosis
+
+    Lists are patched in place, empty strings leave a field unchanged.
+    """
+
+    next_question: str
+    diagnose_complete: Literal["yes", "no"]
+    symptoms: ListPatch
+    possible_diagnoses: ListPatch
+    confidence_level: ListPatch
+    red_flags: ListPatch
+    can_diagnose: Literal["yes", "no"]
+    diagnosed_with: str
+    family_history_related: Literal["yes", "no"]
+
+
+class Triage(DiagnosisPatch):
+    personal_details: PersonalDetails  # Corrections only, unchanged fields empty
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON schema of an object whose properties are all required, as strict mode expects"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+_STRING = {"type": "string"}
+_YES_NO = {"type": "string", "enum": ["yes", "no"]}
+_STRINGS = {"type": "array", "items": _STRING}
+_INTEGER = {"type": "integer"}
+
+
+def _list_patch(items: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON schema of a ListPatch of a list whose items follow ``items``"""
+    return _object(
+        {
+            "append": {"type": "array", "items": items},
+            "replace": {
+                "type": "array",
+                "items": _object({"index": _INTEGER, "value": items}),
+            },
+            "remove": {"type": "array", "items": _INTEGER},
+        }
+    )
+
+PERSONAL_DETAILS_FIELDS = list(PersonalDetails.__annotations__)
+
+
+def personal_details_schema(fields: List[str]) -> Dict[str, Any]:
+    """Schema of the personal details, restricted to some of the fields
+
+    Args:
+        fields: The fields the model has to fill
+
+    Returns:
+        The schema
+    """
+    return {
+        "name": "personal_details",
+        "strict": True,
+        "schema": _object({field: _STRING for field in fields}),
+    }
+
+
+# Schemas passed as json_schema response formats, field names match the TypedDicts
+PERSONAL_DETAILS_SCHEMA = personal_details_schema(PERSONAL_DETAILS_FIELDS)
+
+_CONFIDENCE = _object({"diagnosis": _STRING, "confidence": _INTEGER})
+
+# The changes to the diagnosis plus the personal details mentioned in the
+# same message, so one request per turn serves both. Only changes are
+# generated, so the response stays the same size as the interview grows
+TRIAGE_SCHEMA = {
+    "name": "triage",
+    "strict": True,
+    "schema": _object(
+        {
+            # First, so a streamed question reaches the user before the rest
+            "next_question": _STRING,
+            "diagnose_complete": _YES_NO,
+            "symptoms": _list_patch(_STRING),
+            "possible_diagnoses": _list_patch(_STRING),
+            "confidence_level": _list_patch(_CONFIDENCE),
+            "red_flags": _list_patch(_STRING),
+            "can_diagnose": _YES_NO,
+            "diagnosed_with": _STRING,
+            "family_history_related": _YES_NO,
+            "personal_details": PERSONAL_DETAILS_SCHEMA["schema"],
+        }
+    ),
+}
+
+
+def response_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the response_format that constrains a completion to a schema
+
+    Args:
+        schema: One of the schemas of this module
+
+    Returns:
+        The response_format argument of chat.completions.create
+    """
+    return {"type": "json_schema", "json_schema": schema}
+
+
+def parse_json(content: Optional[str]) -> Dict[str, Any]:
+    """Parse a JSON object response in a single pass
+
+    Args:
+        content: The message content of the completion
+
+    Returns:
+        The parsed object
+
+    Raises:
+        ValueError: If the content is not a JSON object
+    """
+    if not content:
+        raise ValueError("The response is empty")
+
+    content = content.strip()
+    if content.startswith("```"):  # Fenced by a model that ignored the format
+        content = content[content.find("\n") + 1 : content.rfind("```")]
+
+    data = json.loads(content)  # json.JSONDecodeError is a ValueError
+    if not isinstance(data, dict):
+        raise ValueError("The response is not a JSON object")
+    return data
+
+
+async def repair_json(
+    client: AsyncAzureOpenAI,
+    messages: List[Dict[str, str]],
+    content: Optional[str],
+    error: Exception,
+    schema: Dict[str, Any],
+    task: str = "triage",
+    priority: Priority = Priority.TRIAGE,
+) -> Optional[Dict[str, Any]]:
+    """Ask the model once to fix a malformed response
+
+    Args:
+        client: Async Azure OpenAI client
+        messages: The messages of the request that produced the response
+        content: The malformed response
+        error: Why the response could not be parsed
+        schema: The schema the response must follow
+        task: Route of the request, the repair uses it too
+        priority: Admission order of the request
+
+    Returns:
+        The parsed object, None if the repaired response is malformed too
+    """
+    completion = await create_completion(
+        client,
+        task=task,
+        use_cache=False,  # The cached answer is the one being repaired
+        priority=priority,
+        messages=messages
+        + [
+            {"role": "assistant", "content": content or ""},
+            {
+                "role": "user",
+                "content": f"That response could not be parsed ({error}). "
+                "Reply with the same answer as a single valid JSON object only.",
+            },
+        ],
+        response_format=response_format(schema),
+    )
+    try:
+        return parse_json(completion.choices[0].message.content)
+    except ValueError:
+        return None
+
+
+async def extract_json(
+    client: AsyncAzureOpenAI,
+    messages: List[Dict[str, str]],
+    schema: Dict[str, Any],
+    task: str = "triage",
+    use_cache: bool = True,
+    priority: Priority = Priority.TRIAGE,
+    **params: Any,
+) -> Optional[Dict[str, Any]]:
+    """Request a completion constrained to a schema and parse it
+
+    Malformed output gets exactly one repair attempt, so a bad response costs
+    at most one extra call instead of a wasted turn for the user.
+
+    Args:
+        client: Async Azure OpenAI client
+        messages: The messages of the request
+        schema: The schema the response must follow
+        task: Route of the request
+        use_cache: Whether the completion cache may answer the request
+        priority: Admission order of the request
+        **params: Extra arguments for chat.completions.create
+
+    Returns:
+        The parsed object, None if no valid object could be obtained
+    """
+    completion = await create_completion(
+        client,
+        task=task,
+        use_cache=use_cache,
+        priority=priority,
+        messages=messages,
+        response_format=response_format(schema),
+        **params,
+    )
+    content = completion.choices[0].message.content
+    try:
+        with STAGE_SECONDS.time(stage="parse"):
+            return parse_json(content)
+    except ValueError as e:
+        return await repair_json(
+            client, messages, content, e, schema, task, priority
+        )
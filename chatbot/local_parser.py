@@ -0,0 +1,144 @@
+import re
+from typing import Dict, List, Tuple
+
+# Phone numbers with an optional country code, separators allowed
+_MOBILE = re.compile(r"(?<![\d+])(?:\+\d{1,3}[\s-]?)?\d(?:[\s-]?\d){9}(?!\d)")
+
+# Ages with an explicit marker, e.g. "21 years old", "age: 21", "21yo"
+_AGE_MARKED = re.compile(
+    r"\b(?:age[d]?\s*(?:is|:)?\s*(\d{1,3})|(\d{1,3})\s*(?:years?(?:\s*old)?|yrs?(?:\s*old)?|y/?o)\b)",
+    re.IGNORECASE,
+)
+# Age glued to a gender, e.g. "21M", "21/F", "M21", but not the m of "I'm 30"
+_AGE_GENDER = re.compile(
+    r"\b(?:(\d{1,3})\s*/?\s*([mf])|(?<!')([mf])\s*/?\s*(\d{1,3}))\b",
+    re.IGNORECASE,
+)
+_NUMBER = re.compile(r"\b\d{1,3}\b")
+# What may separate a bare age from the name or gender it follows or precedes
+_AGE_SEPARATOR = re.compile(r"[\s,/-]*")
+
+_GENDERS = {
+    "male": "Male",
+    "man": "Male",
+    "boy": "Male",
+    "female": "Female",
+    "woman": "Female",
+    "girl": "Female",
+    "non-binary": "Non-binary",
+    "nonbinary": "Non-binary",
+}
+_GENDER = re.compile(r"\b(" + "|".join(_GENDERS) + r")\b", re.IGNORECASE)
+
+# "I'm X" only counts when X is capitalized, "my name is x" always does
+_NAME_INTRO = re.compile(
+    r"\b(?i:i'?m|i am|this is)\s+([A-Z][a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)"
+)
+_NAME_EXPLICIT = re.compile(
+    r"\b(?i:my name is|name\s*(?:is|:))\s+([a-zA-Z]+(?:\s+[A-Z][a-zA-Z]+)?)"
+)
+# Capitalized words that follow "I'm" without being a name
+_NOT_NAMES = {
+    "a", "an", "the", "also", "currently", "feeling", "fine", "from", "good",
+    "having", "here", "in", "not", "sick", "suffering", "working",
+}  # fmt: skip
+
+# Words that carry no detail once the matched values are removed
+_FILLER = {
+    "i", "im", "i'm", "am", "my", "name", "is", "this", "and", "a", "an",
+    "age", "aged", "years", "year", "old", "yrs", "yo", "mobile", "phone",
+    "number", "no", "contact", "gender", "hi", "hello", "hey",
+}  # fmt: skip
+_WORD = re.compile(r"[a-zA-Z'][a-zA-Z'-]*")
+
+
+def _age(value: str) -> str:
+    """Keep plausible ages only"""
+    return value if 0 < int(value) <= 120 else ""
+
+
+def _adjacent(text: str, span: Tuple[int, int], other: Tuple[int, int]) -> bool:
+    """Whether only separators stand between two spans of the text"""
+    start, end = min(span[1], other[1]), max(span[0], other[0])
+    return start <= end and _AGE_SEPARATOR.fullmatch(text, start, end) is not None
+
+
+def parse_personal_details(user_message: str) -> Tuple[Dict[str, str], str]:
+    """Extract Name, Age, Mobile and Gender with rules, without calling a model
+
+    Only values matched with confidence are returned, anything ambiguous is
+    left to the model.
+
+    Args:
+        user_message: The message of the user
+
+    Returns:
+        Tuple containing the fields that were found and the remainder of the
+        message that none of the rules consumed, empty when the message only
+        contained the found details
+    """
+    data: Dict[str, str] = {}
+    spans: List[Tuple[int, int]] = []
+
+    def consume(match: re.Match, group: int = 0) -> str:
+        spans.append(match.span(0))
+        return match.group(group)
+
+    match = _MOBILE.search(user_message)
+    if match:
+        data["Mobile"] = re.sub(r"[\s-]", "", consume(match))
+
+    # Hide the phone number so its digits are not taken for an age
+    text = user_message
+    for start, end in spans:
+        text = text[:start] + " " * (end - start) + text[end:]
+
+    match = _AGE_GENDER.search(text)
+    if match:
+        age = _age(match.group(1) or match.group(4))
+        if age:
+            consume(match)
+            data["Age"] = age
+            letter = (match.group(2) or match.group(3)).lower()
+            data["Gender"] = "Male" if letter == "m" else "Female"
+
+    if "Age" not in data:
+        match = _AGE_MARKED.search(text)
+        if match and _age(match.group(1) or match.group(2)):
+            data["Age"] = _age(consume(match, 1 if match.group(1) else 2))
+
+    # Spans of the name and gender words a bare age may stand next to
+    anchors: List[Tuple[int, int]] = []
+
+    if "Gender" not in data:
+        genders = {_GENDERS[m.group(1).lower()] for m in _GENDER.finditer(text)}
+        if len(genders) == 1:
+            for m in _GENDER.finditer(text):
+                consume(m)
+                anchors.append(m.span())
+            data["Gender"] = genders.pop()
+
+    match = _NAME_EXPLICIT.search(text) or _NAME_INTRO.search(text)
+    if match and match.group(1).split()[0].lower() not in _NOT_NAMES | set(_GENDERS):
+        data["Name"] = consume(match, 1).title()
+        anchors.append(match.span(1))
+
+    if "Age" not in data:
+        # A number right next to the name or gender is an age, e.g.
+        # "I'm Mani, 21 Male", but not the 2 of "I'm Mani. I have 2 kids"
+        ages = [
+            number
+            for number in _NUMBER.finditer(text)
+            if _age(number.group())
+            and any(_adjacent(text, number.span(), anchor) for anchor in anchors)
+        ]
+        if len(ages) == 1:
+            data["Age"] = consume(ages[0])
+
+    for start, end in spans:
+        text = text[:start] + " " * (end - start) + text[end:]
+    remainder = " ".join(
+        word for word in _WORD.findall(text) if word.lower() not in _FILLER
+    )
+
+    return data, remainder
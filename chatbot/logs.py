@@ -0,0 +1,19 @@
+import logging
+
+# Messages, chat context and model output, which contain personal data and
+# can be large. Logged at DEBUG and disabled unless explicitly enabled.
+payload_logger = logging.getLogger("doc_room.payloads")
+
+
+def configure_logging(level: str = "INFO", payloads: bool = False) -> None:
+    """Set up leveled logging for the bot
+
+    Args:
+        level: Level of the root logger, e.g. "INFO" or "DEBUG"
+        payloads: Whether message and model payloads are logged
+    """
+    logging.basicConfig(
+        level=level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+    payload_logger.setLevel(logging.DEBUG if payloads else logging.WARNING)
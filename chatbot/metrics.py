@@ -0,0 +1,340 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds, from a cache hit to a slow streamed diagnosis
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATIO_BUCKETS = (0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A metric family in the Prometheus text format
+
+    Values are kept per combination of label values. Updates take a lock, so
+    metrics can be updated from the storage flusher thread as well as the
+    event loop.
+
+    Args:
+        name: Name of the metric
+        documentation: Help text of the metric
+        labels: Names of the labels every update must set
+        registry: Registry the metric is exposed by, None for no registry
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """(name, labels, value) of every sample of the metric"""
+        with self._lock:
+            return [
+                (self.name, self._labels(key), value)
+                for key, value in self._values.items()
+            ]
+
+    def render(self) -> str:
+        """The metric in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. requests or tokens"""
+
+    type = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        if not self.label_names:
+            self._values[()] = 0  # Exposed before the first increment
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. active sessions
+
+    Unlabelled gauges can read their value from a function when scraped.
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from ``function`` at scrape time"""
+        self._function = function
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        if self._function is not None:
+            return [(self.name, {}, self._function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Distribution of observed values, e.g. latencies in seconds
+
+    Args:
+        buckets: Upper bounds of the buckets, +Inf is added
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self, *args: Any, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs: Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the seconds the block takes, failures included"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else repr(float(bound))
+                samples.append((f"{self.name}_bucket", {**labels, "le": le}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """The metrics exposed by one exporter"""
+
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        return "".join(metric.render() for metric in self.metrics)
+
+
+registry = Registry()
+
+STAGE_SECONDS = Histogram(
+    "doc_room_stage_seconds",
+    "Seconds spent in each stage of answering a user",
+    ["stage"],
+    registry=registry,
+)
+LLM_TOKENS = Counter(
+    "doc_room_llm_tokens_total",
+    "Tokens reported in the usage of LLM responses, cached is part of prompt",
+    ["route", "kind"],
+    registry=registry,
+)
+LLM_COST = Counter(
+    "doc_room_llm_cost_usd_total",
+    "Dollars spent on LLM responses at the configured token prices",
+    ["route"],
+    registry=registry,
+)
+ROUTE_SECONDS = Histogram(
+    "doc_room_llm_route_seconds",
+    "Seconds until the LLM response of each route, the first chunk for streams",
+    ["route"],
+    registry=registry,
+)
+LLM_REQUESTS = Counter(
+    "doc_room_llm_requests_total",
+    "LLM requests by outcome: ok, cached or the error type",
+    ["outcome"],
+    registry=registry,
+)
+CACHED_PROMPT_RATIO = Histogram(
+    "doc_room_llm_cached_prompt_ratio",
+    "Share of the prompt tokens of each LLM response served from the prompt cache",
+    ["route"],
+    buckets=RATIO_BUCKETS,
+    registry=registry,
+)
+RATE_LIMITED = Counter(
+    "doc_room_llm_rate_limited_total",
+    "429 responses received from Azure OpenAI",
+    registry=registry,
+)
+ERRORS = Counter(
+    "doc_room_errors_total",
+    "Failures while answering users, by stage",
+    ["stage"],
+    registry=registry,
+)
+ACTIVE_SESSIONS = Gauge(
+    "doc_room_active_sessions",
+    "Users with an ongoing conversation in this process",
+    registry=registry,
+)
+SESSIONS_EXPIRED = Counter(
+    "doc_room_sessions_expired_total",
+    "Sessions moved out of memory, by reason: idle or evicted",
+    ["reason"],
+    registry=registry,
+)
+QUEUED_REQUESTS = Gauge(
+    "doc_room_llm_queued_requests",
+    "LLM requests waiting for admission by the request scheduler",
+    registry=registry,
+)
+QUEUED_REPORTS = Gauge(
+    "doc_room_queued_reports",
+    "Doctor reports waiting for a background worker",
+    registry=registry,
+)
+EVENT_LOOP_LAG = Gauge(
+    "doc_room_event_loop_lag_seconds",
+    "How late the last periodic wakeup of the event loop was",
+    registry=registry,
+)
+
+
+def record_usage(usage: Any, route: str) -> None:
+    """Count the tokens of an LLM response
+
+    Args:
+        usage: The ``usage`` of a completion or of the last streamed chunk
+        route: Task the request was routed for
+    """
+    LLM_TOKENS.inc(usage.prompt_tokens, route=route, kind="prompt")
+    LLM_TOKENS.inc(usage.completion_tokens, route=route, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details else None
+    if cached:
+        LLM_TOKENS.inc(cached, route=route, kind="cached")
+    if usage.prompt_tokens:
+        CACHED_PROMPT_RATIO.observe((cached or 0) / usage.prompt_tokens, route=route)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = registry
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # Scrapes every few seconds would flood the logs
+
+
+def start_http_server(
+    port: int, host: str = "127.0.0.1", registry: Registry = registry
+) -> ThreadingHTTPServer:
+    """Expose the metrics on http://host:port/metrics from a daemon thread
+
+    The exporter does not run on the event loop, so it keeps answering
+    while the loop is busy, which is when the metrics matter most.
+
+    Args:
+        port: Port to listen on
+        host: Interface to listen on, local only by default
+        registry: The metrics to expose
+
+    Returns:
+        The server, call shutdown() to stop it
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-exporter", daemon=True
+    ).start()
+    return server
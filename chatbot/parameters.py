@@ -1,6 +1,56 @@
+import json
 import os
 
+from dotenv import load_dotenv
+
+# Read .env before the settings below, whichever module imports this first
+load_dotenv()
+
 AZURE_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_API_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 CHAT_MODEL = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT_NAME")
+
+# Token budget for the verbatim chat turns sent with every prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Upper bound for the rolling summary that replaces older turns
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+# Completion cache: "memory", "disk" to keep hits across restarts, or "off"
+COMPLETION_CACHE = os.getenv("COMPLETION_CACHE", "memory")
+COMPLETION_CACHE_FILE = os.getenv("COMPLETION_CACHE_FILE", "completion_cache.db")
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "1000"))
+# Seconds a cached completion stays valid
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+
+# Quotas of the Azure deployment, 0 disables the corresponding limit
+AZURE_REQUESTS_PER_MINUTE = float(os.getenv("AZURE_REQUESTS_PER_MINUTE", "0"))
+AZURE_TOKENS_PER_MINUTE = float(os.getenv("AZURE_TOKENS_PER_MINUTE", "0"))
+# Retries of a request rejected with a 429
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+# Completion tokens assumed for a request that does not set max_tokens
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("COMPLETION_TOKENS_ESTIMATE", "400"))
+
+# Deployments to load balance over, a JSON list of objects with endpoint,
+# api_key, deployment and optionally name, model and api_version
+AZURE_OPENAI_DEPLOYMENTS = json.loads(os.getenv("AZURE_OPENAI_DEPLOYMENTS", "[]"))
+# API version of the Azure OpenAI clients, json_schema response formats need
+# 2024-08-01-preview or later
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
+# Seconds before a request to one deployment fails over to the next
+AZURE_REQUEST_TIMEOUT = float(os.getenv("AZURE_REQUEST_TIMEOUT", "60"))
+# Seconds a failing deployment is skipped for
+AZURE_FAILOVER_COOLDOWN = float(os.getenv("AZURE_FAILOVER_COOLDOWN", "30"))
+
+# Model of the diagnosis reasoning, and of the lightweight extraction and
+# summarization calls, which a small fast model such as gpt-4o-mini handles.
+# With a single Azure client these are deployment names, with
+# AZURE_OPENAI_DEPLOYMENTS the models the deployments serve
+REASONING_MODEL = os.getenv("REASONING_MODEL", CHAT_MODEL or "gpt-4o")
+EXTRACTION_MODEL = os.getenv("EXTRACTION_MODEL", REASONING_MODEL)
+# Per-task overrides of the routes, a JSON object mapping a task to its
+# model and generation settings, e.g. {"triage": {"temperature": 0.2}}
+MODEL_ROUTES = json.loads(os.getenv("MODEL_ROUTES", "{}"))
+# US dollars per million prompt, cached prompt and completion tokens of each
+# model, merged over the list prices of gpt-4o and gpt-4o-mini
+MODEL_PRICES = json.loads(os.getenv("MODEL_PRICES", "{}"))
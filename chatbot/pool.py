@@ -0,0 +1,195 @@
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import openai
+from openai import AsyncAzureOpenAI
+
+from chatbot.scheduler import retry_after
+
+# Errors after which another deployment may still succeed
+FAILOVER_ERRORS = (
+    openai.APIConnectionError,  # Includes timeouts
+    openai.InternalServerError,
+    openai.RateLimitError,
+)
+
+
+class Deployment:
+    """One Azure OpenAI deployment of the pool
+
+    Args:
+        name (str): Label used in logs and stats, e.g. the region
+        client (AsyncAzureOpenAI): Client of the deployment's endpoint
+        deployment (str): Deployment name sent as the model of the request
+        model (str): Model the deployment serves, what call sites ask for
+    """
+
+    def __init__(
+        self, name: str, client: AsyncAzureOpenAI, deployment: str, model: str = "gpt-4o"
+    ) -> None:
+        self.name = name
+        self.client = client
+        self.deployment = deployment
+        self.model = model
+        self.in_flight = 0
+        self.latency = 1.0  # Moving average of seconds per request
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def expected_wait(self) -> float:
+        """Seconds a new request is expected to take, queueing included"""
+        return (self.in_flight + 1) * self.latency
+
+    def record_success(self, seconds: float) -> None:
+        self.latency = 0.8 * self.latency + 0.2 * seconds
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def record_failure(self, cooldown: float) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        # Back off longer from a deployment that keeps failing
+        self.unhealthy_until = time.monotonic() + min(
+            cooldown * 2 ** (self.consecutive_failures - 1), cooldown * 16
+        )
+
+
+class ClientPool:
+    """Spreads completion requests over several Azure OpenAI deployments
+
+    Each request goes to the healthy deployment of the requested model with
+    the lowest expected wait, i.e. in-flight requests times average latency.
+    Connection errors, timeouts, 5xx and 429 responses mark the deployment
+    unhealthy for a cooldown and the request fails over to the next one.
+
+    The pool is a drop-in replacement for AsyncAzureOpenAI as far as
+    ``client.chat.completions.create`` goes.
+
+    Args:
+        deployments (List[Deployment]): The deployments to route over
+        cooldown (float): Seconds a failed deployment is skipped for
+        timeout (float): Seconds before a request fails over
+    """
+
+    def __init__(
+        self, deployments: List[Deployment], cooldown: float = 30.0, timeout: float = 60.0
+    ) -> None:
+        if not deployments:
+            raise ValueError("A client pool needs at least one deployment")
+        self.deployments = deployments
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    @classmethod
+    def from_config(
+        cls,
+        config: List[Dict[str, str]],
+        api_version: Optional[str] = None,
+        cooldown: float = 30.0,
+        timeout: float = 60.0,
+    ) -> "ClientPool":
+        """Build a pool from a list of endpoint/deployment settings
+
+        All clients share one keep-alive HTTP connection pool.
+
+        Args:
+            config (List[Dict[str, str]]): Items with endpoint, api_key and
+                deployment, and optionally name, model and api_version
+            api_version (Optional[str]): Default API version
+            cooldown (float): Seconds a failed deployment is skipped for
+            timeout (float): Seconds before a request fails over
+
+        Returns:
+            ClientPool: The pool
+        """
+        http_client = openai.DefaultAsyncHttpxClient()
+        deployments = []
+        for item in config:
+            client = AsyncAzureOpenAI(
+                azure_endpoint=item["endpoint"],
+                api_key=item["api_key"],
+                api_version=item.get("api_version", api_version),
+                max_retries=0,  # Failover and the request scheduler retry instead
+                http_client=http_client,
+            )
+            deployments.append(
+                Deployment(
+                    item.get("name", item["endpoint"]),
+                    client,
+                    item["deployment"],
+                    item.get("model", "gpt-4o"),
+                )
+            )
+        return cls(deployments, cooldown, timeout)
+
+    def _candidates(self, model: str) -> List[Deployment]:
+        deployments = [d for d in self.deployments if d.model == model]
+        if not deployments:
+            raise ValueError(f"No deployment in the pool serves {model}")
+
+        healthy = [d for d in deployments if d.healthy]
+        if healthy:
+            return sorted(healthy, key=Deployment.expected_wait)
+        # Everything is cooling down, try the one that recovers first
+        return sorted(deployments, key=lambda d: d.unhealthy_until)
+
+    async def create(self, **params: Any) -> Any:
+        """Send a chat completion request, failing over between deployments
+
+        Args:
+            **params: Arguments of chat.completions.create, ``model`` names
+                the model and is replaced by the chosen deployment
+
+        Returns:
+            The completion, or the chunk stream when ``stream=True``
+        """
+        params.setdefault("timeout", self.timeout)
+        last_error: Optional[Exception] = None
+        for deployment in self._candidates(params.get("model", "gpt-4o")):
+            deployment.in_flight += 1
+            deployment.requests += 1
+            started = time.monotonic()
+            try:
+                completion = await deployment.client.chat.completions.create(
+                    **{**params, "model": deployment.deployment}
+                )
+            except FAILOVER_ERRORS as e:
+                cooldown = None
+                if isinstance(e, openai.RateLimitError):
+                    cooldown = retry_after(e)  # The quota resets sooner than that
+                deployment.record_failure(cooldown or self.cooldown)
+                last_error = e
+                continue
+            finally:
+                deployment.in_flight -= 1
+            deployment.record_success(time.monotonic() - started)
+            return completion
+
+        raise last_error
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Load and health of each deployment, for monitoring
+
+        Returns:
+            List[Dict[str, Any]]: One item per deployment
+        """
+        return [
+            {
+                "name": d.name,
+                "model": d.model,
+                "healthy": d.healthy,
+                "in_flight": d.in_flight,
+                "latency": d.latency,
+                "requests": d.requests,
+                "failures": d.failures,
+            }
+            for d in self.deployments
+        ]
@@ -0,0 +1,180 @@
+"""Prompt templates of the LLM calls
+
+Azure OpenAI caches the longest prompt prefix it has seen recently, in 128
+token steps from 1024 tokens on, and bills and serves the cached part faster.
+Each request therefore starts with the static instructions, kept byte for
+byte identical across users and turns, followed by the data that changes
+least often: patient data, then the summary and the chat turns as separate
+messages, and the new user message last.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+Message = Dict[str, str]
+
+PERSONAL_DETAILS_PARSE_INSTRUCTIONS = (
+    "You are a helpful assistant. Your task is to parse the given user response "
+    "into a JSON object with the fields of the response format. If you didn't "
+    "find any of them in the user's message leave those fields empty."
+)
+
+DIAGNOSIS_INSTRUCTIONS = """\
+You are a thorough medical assistant conducting a detailed patient interview.
+Your task is to systematically gather information and prepare a detailed medical report for the doctor.
+The patient information, the conversation so far and the current medical record follow these instructions.
+
+Follow this structured approach:
+1. First, identify and confirm all reported symptoms
+2. For each symptom, ask about:
+   - Onset (when it started)
+   - Duration (how long it lasts)
+   - Frequency (how often it occurs)
+   - Severity (on a scale of 1-10)
+   - Triggers (what makes it worse)
+   - Alleviating factors (what makes it better)
+3. Ask about associated symptoms
+4. Inquire about medical history, medications, and allergies
+5. Consider lifestyle factors and recent changes
+6. Specifically ask about family history related to current symptoms
+
+Return only what the latest message changes in the medical record, as a JSON response with fields:
+1. next_question (specific question to narrow down the diagnosis)
+2. diagnose_complete (yes/no)
+3. symptoms (changes to the detailed list of identified symptoms with their characteristics)
+4. possible_diagnoses (changes to the list of potential diagnoses in order of likelihood)
+5. confidence_level (changes to the percentage for each diagnosis)
+6. red_flags (changes to the concerning symptoms that need immediate attention)
+7. can_diagnose (yes/no - whether enough information is available for a diagnosis)
+8. diagnosed_with (the final diagnosis, empty until diagnose_complete is yes or if unchanged)
+9. family_history_related (yes/no - whether there is family history related to current symptoms)
+10. personal_details (Name, Age, Mobile, Gender, Address, Occupation, Family History: only the ones the latest message provides or corrects, leave the others empty)
+
+The changes to a list have three parts: append (new items), replace (index of an item of the current list and its new value) and remove (indexes of items of the current list that no longer apply). Indexes start at 0. Never repeat items that are already in the record and unchanged."""
+
+
+DOCTOR_REPORT_INSTRUCTIONS = """\
+You are a medical assistant writing the handover report of a patient interview for the doctor.
+The patient information, the medical record and the interview follow these instructions.
+
+Write a concise, detailed report with these sections:
+1. Patient: the relevant personal details
+2. Presenting complaint and history, each symptom with onset, duration, frequency, severity, triggers and alleviating factors
+3. Medical history, medications, allergies, lifestyle and family history
+4. Red flags
+5. Assessment: possible diagnoses with confidence, and the most likely diagnosis
+6. Open questions the doctor should follow up on
+
+Reply with the report only."""
+
+
+def data_message(label: str, data: Dict[str, Any]) -> Message:
+    """A system message holding a record, serialized the same way every time
+
+    Args:
+        label: What the record is, e.g. "Patient information"
+        data: The record
+
+    Returns:
+        The message
+    """
+    return {
+        "role": "system",
+        "content": f"{label}: {json.dumps(data, sort_keys=True)}",
+    }
+
+
+def history_messages(
+    chat_history: List[Tuple[str, str]], summary: str = ""
+) -> List[Message]:
+    """The summary and the chat turns as messages, oldest first
+
+    Turns are sent as messages of their own role rather than one formatted
+    block, so the prompt of the next turn extends the prompt of this one.
+
+    Args:
+        chat_history: Recent (role, message) turns
+        summary: Summary of the older turns
+
+    Returns:
+        The messages
+    """
+    messages = []
+    if summary:
+        messages.append(
+            {"role": "system", "content": f"Summary of earlier conversation: {summary}"}
+        )
+    messages += [{"role": role, "content": message} for role, message in chat_history]
+    return messages
+
+
+def personal_details_parse_messages(user_message: str) -> List[Message]:
+    """Messages of a request that parses personal details from a message
+
+    Args:
+        user_message: The user's message
+
+    Returns:
+        The messages
+    """
+    return [
+        {"role": "system", "content": PERSONAL_DETAILS_PARSE_INSTRUCTIONS},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def doctor_report_messages(
+    user_data: Dict[str, str],
+    medical_data: Dict[str, Any],
+    chat_history: List[Tuple[str, str]],
+    summary: str = "",
+) -> List[Message]:
+    """Messages of a request that writes the report for the doctor
+
+    Args:
+        user_data: User's personal information
+        medical_data: The stored diagnosis
+        chat_history: (role, message) turns of the interview
+        summary: Rolling summary of the turns that no longer fit the context
+
+    Returns:
+        The messages
+    """
+    return [
+        {"role": "system", "content": DOCTOR_REPORT_INSTRUCTIONS},
+        data_message("Patient Information", user_data),
+        data_message("Medical record", medical_data),
+        *history_messages(chat_history, summary),
+        {"role": "user", "content": "Write the report for the doctor."},
+    ]
+
+
+def diagnosis_messages(
+    user_message: str,
+    user_data: Dict[str, str],
+    chat_history: List[Tuple[str, str]],
+    summary: str = "",
+    medical_data: Optional[Dict[str, Any]] = None,
+) -> List[Message]:
+    """Messages of a diagnosis request
+
+    The medical record changes every turn, so it comes after the chat turns
+    to keep them in the cached prefix.
+
+    Args:
+        user_message: User's message about their symptoms
+        user_data: User's personal information
+        chat_history: Previous (role, message) turns of this user
+        summary: Rolling summary of the turns that no longer fit the context
+        medical_data: The stored medical record the response patches
+
+    Returns:
+        The messages
+    """
+    return [
+        {"role": "system", "content": DIAGNOSIS_INSTRUCTIONS},
+        data_message("Patient Information", user_data),
+        *history_messages(chat_history, summary),
+        data_message("Current medical record", medical_data or {}),
+        {"role": "user", "content": user_message},
+    ]
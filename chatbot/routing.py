@@ -0,0 +1,116 @@
+from typing import Any, Dict
+
+from chatbot.metrics import LLM_COST, record_usage
+from chatbot.parameters import (
+    EXTRACTION_MODEL,
+    MODEL_PRICES,
+    MODEL_ROUTES,
+    REASONING_MODEL,
+    SUMMARY_MAX_TOKENS,
+)
+
+# US dollars per million tokens
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o": {"prompt": 2.50, "cached": 1.25, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "cached": 0.075, "completion": 0.60},
+}
+
+# Model and generation settings of each task, before the MODEL_ROUTES overrides
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "greeting": {"model": EXTRACTION_MODEL},
+    "personal_details": {"model": EXTRACTION_MODEL, "temperature": 0},
+    "summary": {
+        "model": EXTRACTION_MODEL,
+        "temperature": 0,
+        "max_tokens": SUMMARY_MAX_TOKENS,
+    },
+    "triage": {"model": REASONING_MODEL},
+    "doctor_report": {"model": REASONING_MODEL},
+}
+
+
+class Route:
+    """Where the requests of one task go and how they are generated
+
+    Args:
+        task (str): Name of the task, the label of its metrics
+        model (str): Model, or deployment name with a single Azure client
+        price (Dict[str, float]): Dollars per million prompt, cached and
+            completion tokens, empty when unknown
+        **settings: Arguments of chat.completions.create, e.g. temperature
+    """
+
+    def __init__(
+        self, task: str, model: str, price: Dict[str, float], **settings: Any
+    ) -> None:
+        self.task = task
+        self.model = model
+        self.price = price
+        self.settings = settings
+
+    def params(self, **params: Any) -> Dict[str, Any]:
+        """Arguments of a request of the task, explicit ones take precedence"""
+        return {"model": self.model, **self.settings, **params}
+
+    def cost(self, usage: Any) -> float:
+        """Dollars a response cost, 0 for a model without a price"""
+        if not self.price:
+            return 0.0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) if details else None) or 0
+        return (
+            (usage.prompt_tokens - cached) * self.price.get("prompt", 0)
+            + cached * self.price.get("cached", self.price.get("prompt", 0))
+            + usage.completion_tokens * self.price.get("completion", 0)
+        ) / 1e6
+
+    def record(self, usage: Any) -> None:
+        """Count the tokens and the cost of a response of the task
+
+        Args:
+            usage: The ``usage`` of a completion or of the last streamed chunk
+        """
+        record_usage(usage, self.task)
+        LLM_COST.inc(self.cost(usage), route=self.task)
+
+
+def load_routes(
+    overrides: Dict[str, Dict[str, Any]],
+    prices: Dict[str, Dict[str, float]],
+) -> Dict[str, Route]:
+    """Build the routing table
+
+    Args:
+        overrides: Model and settings per task, merged over DEFAULT_ROUTES,
+            unknown tasks are added
+        prices: Prices per model, merged over DEFAULT_PRICES
+
+    Returns:
+        Dict[str, Route]: The route of each task
+    """
+    prices = {**DEFAULT_PRICES, **prices}
+    routes = {}
+    for task in {**DEFAULT_ROUTES, **overrides}:
+        settings = {**DEFAULT_ROUTES.get(task, {}), **overrides.get(task, {})}
+        model = settings.pop("model", REASONING_MODEL)
+        routes[task] = Route(task, model, prices.get(model, {}), **settings)
+    return routes
+
+
+# Shared by every call site
+routes = load_routes(MODEL_ROUTES, MODEL_PRICES)
+
+
+def route(task: str) -> Route:
+    """The route of a task
+
+    Args:
+        task: Name of the task, e.g. "triage"
+
+    Returns:
+        Route: The route
+
+    Raises:
+        KeyError: If the task has no route
+    """
+    return routes[task]
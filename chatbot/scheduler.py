@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import openai
+
+from chatbot.metrics import RATE_LIMITED, STAGE_SECONDS
+
+
+class Priority(IntEnum):
+    """Admission order of completion requests, lower goes first"""
+
+    TRIAGE = 0  # Turns of an interview that is in progress
+    DETAILS = 1  # Summaries of ongoing conversations
+    ONBOARDING = 2  # New users giving their personal details
+    BACKGROUND = 3  # Anything nobody is waiting on
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units per minute up to ``burst_seconds`` worth
+
+    Azure enforces its per-minute quotas over windows of a few seconds, so a
+    burst of a whole minute of budget after an idle period would be rejected.
+
+    Args:
+        per_minute (float): Units granted per minute, 0 disables the limit
+        burst_seconds (float): Seconds of budget that may be spent at once
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0) -> None:
+        self.capacity = per_minute * burst_seconds / 60
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available"""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        # A request larger than the bucket goes through once the bucket is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Consume units, a negative amount gives unused units back"""
+        if self.capacity:
+            self._refill()
+            self.tokens -= amount
+
+
+def retry_after(error: openai.APIStatusError) -> Optional[float]:
+    """Read the delay a 429 response asks for
+
+    Args:
+        error (openai.APIStatusError): The error raised by the client
+
+    Returns:
+        Optional[float]: Seconds to wait, None if the response does not say
+    """
+    headers = error.response.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+class RequestScheduler:
+    """Admission control for every completion request sent to Azure
+
+    Requests wait in a priority queue until the requests-per-minute and
+    estimated tokens-per-minute buckets allow them through. A 429 pauses
+    admission for everyone for the ``Retry-After`` delay, plus jitter so the
+    waiting requests do not all fire at once, and the request is retried.
+
+    Args:
+        requests_per_minute (float): RPM quota of the deployment, 0 for none
+        tokens_per_minute (float): TPM quota of the deployment, 0 for none
+        max_retries (int): Retries of a request rejected with a 429
+        base_backoff (float): Backoff in seconds when a 429 has no Retry-After
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self._queue: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.in_flight = 0
+        self.rate_limited = 0
+
+    async def _admit(self, priority: Priority, estimated_tokens: float) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._queue, (priority, next(self._order), estimated_tokens, future)
+        )
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        queued_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before being cancelled, return the budget
+                self.requests.take(-1)
+                self.tokens.take(-estimated_tokens)
+            raise
+        wait = time.monotonic() - queued_at
+        self._waits.append(wait)
+        STAGE_SECONDS.observe(wait, stage="queue")
+
+    async def _dispatch(self) -> None:
+        while self._queue:
+            self._wakeup.clear()
+            _, _, estimated_tokens, future = self._queue[0]
+            if future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+
+            delay = max(
+                self._paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(estimated_tokens),
+            )
+            if delay > 0:
+                # Wake up early if a more urgent request arrives meanwhile
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+            future.set_result(None)
+
+    async def run(
+        self,
+        request: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.TRIAGE,
+        estimated_tokens: float = 0,
+    ) -> Any:
+        """Run a request once it is admitted, retrying it after 429s
+
+        Args:
+            request (Callable[[], Awaitable[Any]]): Sends the request
+            priority (Priority): Admission order of the request
+            estimated_tokens (float): Prompt plus expected completion tokens
+
+        Returns:
+            Any: The result of the request
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._admit(priority, estimated_tokens)
+            self.in_flight += 1
+            try:
+                result = await request()
+            except openai.RateLimitError as e:
+                self.rate_limited += 1
+                RATE_LIMITED.inc()
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.base_backoff * 2**attempt
+                self._paused_until = max(
+                    self._paused_until,
+                    time.monotonic() + delay * random.uniform(1.0, 1.25),
+                )
+                continue
+            finally:
+                self.in_flight -= 1
+
+            usage = getattr(result, "usage", None)
+            if usage is not None:
+                self.settle(estimated_tokens, usage)
+            return result
+
+    def settle(self, estimated_tokens: float, usage: Any) -> None:
+        """Correct the token budget by what a request really used
+
+        Args:
+            estimated_tokens (float): Tokens taken when it was admitted
+            usage (Any): Usage reported with the completion or its last chunk
+        """
+        self.tokens.take(usage.total_tokens - estimated_tokens)
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth and wait times, for monitoring
+
+        Returns:
+            Dict[str, float]: Queued requests in total and per priority,
+                requests in flight, 429s seen, and the mean and maximum
+                wait of the last 1000 admitted requests in seconds
+        """
+        waiting = [entry for entry in self._queue if not entry[3].done()]
+        stats = {
+            "queue_depth": len(waiting),
+            "in_flight": self.in_flight,
+            "rate_limited": self.rate_limited,
+            "wait_mean": sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            "wait_max": max(self._waits, default=0.0),
+        }
+        for priority in Priority:
+            stats[f"queue_depth_{priority.name.lower()}"] = sum(
+                1 for entry in waiting if entry[0] == priority
+            )
+        return stats
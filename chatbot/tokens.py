@@ -0,0 +1,36 @@
+from typing import Any, Dict, List
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o tokenizer
+except ImportError:  # tiktoken is optional, fall back to an estimate
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of a text locally, without calling the API
+
+    Args:
+        text: The text to count
+
+    Returns:
+        Number of tokens, estimated at ~4 characters per token when tiktoken
+        is not installed
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Count the prompt tokens of chat messages, including their overhead
+
+    Args:
+        messages: Messages of a chat completion request
+
+    Returns:
+        Number of tokens
+    """
+    # Every message costs a few tokens for its role and delimiters
+    return sum(count_tokens(str(message.get("content") or "")) + 4 for message in messages)
@@ -1,25 +1,49 @@
+import asyncio
+import functools
+import logging
 from pathlib import Path
 import random
 import re
-from typing import List, Tuple, Union
+import time
+from typing import List, Optional, Tuple, Union
 import discord
 from discord.ext import commands
-from chatbot.chat import personal_parser, update_personal_details, check_diagnosis
+from openai import AsyncAzureOpenAI
+from chatbot.chat import (
+    personal_parser,
+    check_diagnosis,
+    stream_diagnosis,
+    write_doctor_report,
+)
+from chatbot.context import build_context
+from chatbot.logs import payload_logger
+from chatbot.metrics import (
+    ACTIVE_SESSIONS,
+    ERRORS,
+    EVENT_LOOP_LAG,
+    QUEUED_REPORTS,
+    STAGE_SECONDS,
+)
 
 # from langchain_core.messages import AIMessage, HumanMessage
 from discord_bot.memory import (
-    active_users,
     add_to_chat_history,
-    chat_history,
-    set_user_active,
-    set_user_inactive,
+    get_user_chat_history,
+    trim_chat_history,
+    clear_chat_history,
+    get_conversation_summary,
+    update_conversation_summary,
+    clear_conversation_summary,
     bot_id,
+    tracked_channels,
     get_user_data,
     update_user_data,
     clear_user_data,
     get_medical_data,
-    update_medical_data,
+    merge_medical_patch,
+    patch_medical_data,
     clear_medical_data,
+    get_doctor_report,
 )
 
 # from discord_bot.parameters import (
@@ -30,26 +54,83 @@ from discord_bot.memory import (
 #     VECTORDB_PORT,
 #     VECTORDB_HOST,
 # )
-from discord_bot.state import BotState, empty_active_users, new_user, user_exists
+from discord_bot.coalescer import MessageCoalescer
+from discord_bot.gateway import GatewayStats, gateway_options
+from discord_bot.parameters import (
+    ADMIN_USER_IDS,
+    DOCTOR_USER_IDS,
+    GATEWAY_PROFILE,
+    PROFILE_DIR,
+    SESSION_SWEEP_INTERVAL,
+    STREAM_RESPONSES,
+)
+from discord_bot.profiling import LoopMonitor, MemoryProfiler, SamplingProfiler
+from discord_bot.reports import ReportQueue
+from discord_bot.state import Phase, Session, initial_phase, sessions
+from discord_bot.streaming import StreamingReply
 
 # from expert_system.conversation import Chatbot
 # from nlqs.database.postgres import PostgresConnectionConfig
 # from nlqs.database.sqlite import SQLiteConnectionConfig
 # from nlqs.nlqs import NLQS, ChromaDBConfig, NLQSResult
 
-# Global variable to store the state of the bot
-global_state = BotState.IDLE
+logger = logging.getLogger(__name__)
 
 
-def create_bot(openai_client) -> commands.Bot:
+class Turn:
+    """The answer to a user's messages, applied once it is final
+
+    Args:
+        reply (str): The reply to send
+        summary (str): The user's rolling summary
+        folded (int): Number of oldest chat turns folded into the summary
+    """
+
+    def __init__(self, reply: str, summary: str = "", folded: int = 0) -> None:
+        self.reply = reply
+        self.summary = summary
+        self.folded = folded
+        self.user_data: Optional[dict] = None
+        self.medical_data: Optional[dict] = None  # Patch of the medical data
+        self.phase: Optional[Phase] = None  # Phase the conversation moves to
+        self.streaming_reply: Optional[StreamingReply] = None
+        # time.perf_counter() when the oldest message answered arrived
+        self.received_at = time.perf_counter()
+
+
+def create_bot(
+    openai_client: AsyncAzureOpenAI,
+    shard_ids: Optional[List[int]] = None,
+    shard_count: Optional[int] = None,
+) -> commands.Bot:
     """Create a Discord Bot
 
+    Args:
+        openai_client (AsyncAzureOpenAI): The async Azure OpenAI client
+        shard_ids (Optional[List[int]]): Shards run by this process, all of
+            them when None
+        shard_count (Optional[int]): Total number of shards, Discord's
+            recommendation when None
+
     Returns:
         commands.Bot: The Discord Bot
     """
-    global global_state
-
-    bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        **gateway_options(GATEWAY_PROFILE),
+    )
+    gateway_stats = GatewayStats()
+    gateway_stats.attach(bot)
+    ACTIVE_SESSIONS.set_function(lambda: len(sessions))
+
+    cpu_profiler: Optional[SamplingProfiler] = None
+    memory_profiler = MemoryProfiler()
+    loop_monitor = LoopMonitor(on_lag=EVENT_LOOP_LAG.set)
+    # Doctor reports are written off the path of the user's replies
+    report_queue = ReportQueue(functools.partial(write_doctor_report, openai_client))
+    QUEUED_REPORTS.set_function(lambda: len(report_queue))
 
     # Create the default bot behaviors here
 
@@ -57,19 +138,189 @@ def create_bot(openai_client) -> commands.Bot:
     @bot.event
     async def on_ready() -> None:
         """Prints a message when the bot is connected to Discord"""
-        global global_state
-
         if bot.user is None:
-            print("log the relevant error")
+            logger.error("Ready without a bot user")
             return
 
-        print(f"{bot.user.name} has connected to Discord!")  # Prints in the terminal
-        print(f"Bot ID: {bot.user.id}")
+        logger.info(
+            "%s has connected to Discord, bot ID %s", bot.user.name, bot.user.id
+        )
+        loop_monitor.start()
+        sessions.start_sweeper(SESSION_SWEEP_INTERVAL)
+        report_queue.start()
 
         # Save the bot's ID
         bot_id = bot.user.id
 
-        global_state = BotState.IDLE  # Initial State - Idle
+    coalescer = MessageCoalescer()
+
+    async def onboarding_reply(
+        session: Session, turn: Turn, channel, user_input: str, history: list
+    ) -> None:
+        """Collect the personal details of a new user"""
+        data, turn.reply = await personal_parser(openai_client, user_input)
+        turn.user_data = data
+        if data:
+            turn.phase = Phase.TRIAGE
+
+    async def triage_reply(
+        session: Session, turn: Turn, channel, user_input: str, history: list
+    ) -> None:
+        """Ask about the symptoms until a diagnosis is reached
+
+        Personal details mentioned along the way come back with the same
+        response and are applied too.
+        """
+        user_id = session.user_id
+        previous_data = get_user_data(user_id)
+        medical_data = get_medical_data(user_id)
+        payload_logger.debug("medical data user_id=%s: %s", user_id, medical_data)
+
+        if STREAM_RESPONSES:
+            # Show the next question while the diagnosis is generated
+            turn.streaming_reply = StreamingReply(channel, f"<@{user_id}> ")
+            await turn.streaming_reply.start()
+            try:
+                data, details, turn.reply = await stream_diagnosis(
+                    openai_client,
+                    user_input,
+                    history,
+                    previous_data,
+                    turn.streaming_reply.update,
+                    turn.summary,
+                    medical_data,
+                )
+            except asyncio.CancelledError:
+                # Superseded by a newer message, which gets its own reply
+                turn.streaming_reply.discard_soon()
+                raise
+            except Exception:
+                # Do not leave the placeholder or half a question behind
+                await turn.streaming_reply.fail(
+                    "Sorry, I couldn't process your message. Please try again."
+                )
+                raise
+        else:
+            data, details, turn.reply = await check_diagnosis(
+                openai_client,
+                user_input,
+                history,
+                previous_data,
+                turn.summary,
+                medical_data,
+            )
+        turn.medical_data = data
+        turn.user_data = details
+
+        medical_data = merge_medical_patch(medical_data, data or {})
+        complete = medical_data.get("diagnose_complete") == "yes"
+        if complete and medical_data.get("diagnosed_with"):
+            turn.phase = Phase.AWAITING_DOCTOR
+
+    async def awaiting_doctor_reply(
+        session: Session, turn: Turn, channel, user_input: str, history: list
+    ) -> None:
+        """Hold the conversation until a doctor takes over"""
+        turn.reply = "I understand your symptoms. Doctor will get back to you soon!!"
+
+    # What answers a message in each phase of a conversation
+    phase_handlers = {
+        Phase.ONBOARDING: onboarding_reply,
+        Phase.TRIAGE: triage_reply,
+        Phase.AWAITING_DOCTOR: awaiting_doctor_reply,
+    }
+
+    async def compute_reply(session: Session, channel, user_input: str) -> Turn:
+        """Produce the answer to the user's messages without changing any state
+
+        Args:
+            session (Session): The user's conversation
+            channel (discord.abc.Messageable): Channel of the conversation
+            user_input (str): The user's messages, merged
+
+        Returns:
+            Turn: The reply and the updates to apply
+        """
+        if session.closed:
+            return Turn(reply="")  # Ended while the messages were waiting
+
+        received_at = coalescer.received_at(session.user_id)
+        user_id = session.user_id
+
+        # Set the typing state on the channel
+        await channel.typing()
+
+        # Only this user's turns in this channel are sent as context,
+        # older turns are folded into the user's rolling summary
+        with STAGE_SECONDS.time(stage="context"):
+            user_chat_history, summary, folded = await build_context(
+                openai_client,
+                get_user_chat_history(user_id, channel.id),
+                get_conversation_summary(user_id),
+            )
+
+        turn = Turn(reply="", summary=summary, folded=folded)
+        if received_at is not None:
+            turn.received_at = received_at
+        await phase_handlers[session.phase](
+            session, turn, channel, user_input, user_chat_history
+        )
+        return turn
+
+    async def commit_reply(
+        session: Session, channel, user_input: str, turn: Turn
+    ) -> None:
+        """Apply the answer to the user's messages and send the reply
+
+        Args:
+            session (Session): The user's conversation
+            channel (discord.abc.Messageable): Channel of the conversation
+            user_input (str): The user's messages, merged
+            turn (Turn): The answer from compute_reply
+        """
+        # Ended while the reply was being computed, maybe through another
+        # copy of the session, e.g. by another process
+        current = sessions.refresh(session)
+        if current is None:
+            if turn.streaming_reply is not None:
+                await turn.streaming_reply.discard()
+            return
+        session = current
+
+        user_id = session.user_id
+        if turn.folded:
+            update_conversation_summary(user_id, turn.summary)
+            trim_chat_history(user_id, turn.folded, channel.id)
+        if turn.user_data:
+            update_user_data(user_id, turn.user_data)
+        medical_data = None
+        if turn.medical_data:
+            medical_data = patch_medical_data(user_id, turn.medical_data)
+
+        add_to_chat_history(user_id, user_input, channel.id)
+        add_to_chat_history(user_id, turn.reply, channel.id, role="assistant")
+        if medical_data and "yes" in (
+            medical_data.get("diagnose_complete"),
+            medical_data.get("can_diagnose"),
+        ):
+            # Refreshed with every turn from here on, waiting ones are merged
+            report_queue.submit(user_id, channel.id)
+        sessions.advance(session, turn.phase or session.phase)
+
+        # reply = f"processing.........."
+
+        try:
+            with STAGE_SECONDS.time(stage="send"):
+                if turn.streaming_reply is not None:
+                    await turn.streaming_reply.finish(turn.reply)
+                else:
+                    await channel.send(f"<@{user_id}> " + turn.reply)
+        except discord.HTTPException:
+            ERRORS.inc(stage="send")
+            raise
+        # From the arrival of the oldest message answered, through the
+        # coalescing window and the wait for the user's lock, up to the reply
+        STAGE_SECONDS.observe(time.perf_counter() - turn.received_at, stage="turn")
 
     # Event
     @bot.event
@@ -79,40 +330,44 @@ def create_bot(openai_client) -> commands.Bot:
         Args:
             message (_type_): The message sent by the user
         """
-        global global_state
+        received_at = time.perf_counter()  # Start of the turn latency
 
-        user_input = message.content  # Message from the user
-        user_id = message.author.id  # ID of the user
-
-        # Tracks the last 100 messages in chat_history
-        add_to_chat_history(user_id, user_input)
-
-        print(f"chat history: {chat_history}")
-        print(active_users)
-
-        # To prevent bot from replying to it's own message
-        if message.author == bot.user:
+        # To prevent bot from replying to it's own message, or to other bots
+        if message.author.bot:
             return
 
         if bot.user is None:
-            print("log a relevant error")
+            logger.error("Message received without a bot user")
+            return
+
+        # Most traffic is unrelated to the bot, drop it before any other work
+        mentioned = bot.user.mentioned_in(message)
+        channel_id = message.channel.id  # ID of the channel
+        if (
+            not mentioned
+            and channel_id not in tracked_channels
+            and not message.content.startswith(bot.command_prefix)
+        ):
             return
 
+        user_input = message.content  # Message from the user
+        user_id = message.author.id  # ID of the user
+        logger.debug("message user_id=%s channel_id=%s", user_id, channel_id)
+
+        session = sessions.get(user_id)
+
         # When the bot is mentioned in the message
-        if bot.user.mentioned_in(message):
+        if mentioned:
+            tracked_channels.add(channel_id)
             user_input = remove_user_id(user_input)
-            print(f"User Input: {user_input}")
-            if user_id in active_users:
+            payload_logger.debug("user input user_id=%s: %s", user_id, user_input)
+            if session is not None:
                 if "!exit" in user_input:  # To remove conversation
                     await message.channel.send(
                         f"Conversation with the user <@{user_id}> Ended."
                     )
-                    set_user_inactive(user_id)  # Removes the user from active_users
-                    global_state = empty_active_users(
-                        global_state
-                    )  # Sets the bot state to Idle if active_users are empty
-                else:  # Any other prompt
-                    global_state = user_exists()  # Sets the bot state to Engaged
+                    end_conversation(user_id, channel_id)
+                    session = None
             else:
                 # stopping the bot to only ask the users their personal details and adds the user to the active users.
                 reply = (
@@ -120,54 +375,28 @@ def create_bot(openai_client) -> commands.Bot:
                     + "Give us your personal details. Eg: I'm Mani, 21 Male. i'm currently working as a developer at Aegion."
                 )
                 await message.channel.send(reply)
-                set_user_active(
-                    user_id
-                )  # Adding the user to the current going-on conversations
-                global_state = new_user()  # Sets the bot state to Engaged
+                add_to_chat_history(user_id, user_input, channel_id)
+                add_to_chat_history(
+                    user_id, remove_user_id(reply), channel_id, role="assistant"
+                )
+                # Returning users continue where their data left off
+                sessions.start(
+                    user_id,
+                    channel_id,
+                    initial_phase(get_user_data(user_id), get_medical_data(user_id)),
+                )
                 return
 
-        # To Check the state of the bot
-        if (
-            global_state == BotState.ENGAGED
-        ):  # If the bot is in Engaged state (user_conversations exist)
-            if user_id in active_users:
-                # Assume interaction with the user ......
-                # Set the typing state on the channel
-                await message.channel.typing()
-
-                corrected_chat_history = change_chat_history(chat_history)
-
-                # Get existing user data
-                previous_data = get_user_data(user_id)
-                medical_data = get_medical_data(user_id)
-                print(f"Medical data: {medical_data}")
-
-                if not previous_data:
-                    # First time user - use personal_parser
-                    data, reply = personal_parser(openai_client, user_input)
-                    if data:
-                        update_user_data(user_id, data)
-                elif not medical_data.get("diagnose_complete") or not medical_data.get(
-                    "diagnosed_with"
-                ):
-                    # Handle medical diagnosis if diagnosis is not complete or no diagnosis provided
-                    data, reply = check_diagnosis(
-                        openai_client, user_input, chat_history, previous_data
-                    )
-                    if data:
-                        update_medical_data(user_id, data)
-                else:
-                    # Only proceed to general conversation if we have both complete personal data and a diagnosis
-                    reply = (
-                        "I understand your symptoms. Doctor will get back to you soon!!"
-                    )
-
-                chat_history.append((user_input, reply))
-                reply = f"<@{user_id}> " + reply
-
-                # reply = f"processing.........."
-
-                await message.channel.send(reply)
+        if session is not None:
+            # Bursts of messages are answered together, one request at a time
+            # per user: the medical record is per user, whatever the channel
+            coalescer.submit(
+                user_id,
+                user_input,
+                lambda text: compute_reply(session, message.channel, text),
+                lambda text, turn: commit_reply(session, message.channel, text, turn),
+                received_at,
+            )
         # To process the commands
         await bot.process_commands(message)
 
@@ -181,7 +410,6 @@ def create_bot(openai_client) -> commands.Bot:
         Args:
             ctx (Unknown): The context of the command
         """
-        global global_state
         user_id = ctx.author.id
         replies = [
             f"Goodbye <@{user_id}>! Have a great day!",
@@ -190,7 +418,8 @@ def create_bot(openai_client) -> commands.Bot:
         ]
         reply = random.choice(replies)
         await ctx.send(reply)
-        empty_active_users(global_state)
+        if sessions.get(user_id) is not None:
+            end_conversation(user_id, ctx.channel.id)
 
     # STATE
     @bot.command(name="state", help="-Prompts the current state of bot")
@@ -200,18 +429,147 @@ def create_bot(openai_client) -> commands.Bot:
         Args:
             ctx (Unknown): The context of the command
         """
-        global global_state
+        # The bot is Engaged while it has conversations, Idle otherwise,
+        # followed by the phase of the caller's conversation
+        session = sessions.get(ctx.author.id)
+        phase = session.phase if session is not None else Phase.CLOSED
+        if not len(sessions):
+            await ctx.send(f"Idle, your conversation: {phase.value}")
+        else:
+            await ctx.send(
+                f"Engaged in {len(sessions)} conversations, yours: {phase.value}"
+            )
+
+    # GATEWAY
+    @bot.command(name="gateway", help="-Prompts gateway event rates and cache sizes")
+    async def gateway(ctx) -> None:
+        """Prompts the gateway event rates and cache sizes of this process
+
+        Args:
+            ctx (Unknown): The context of the command
+        """
+        report = gateway_stats.report(bot)
+        top_events = ", ".join(
+            f"{event} {rate:.2f}/s" for event, rate in report.pop("top_events").items()
+        )
+        lines = [f"Profile: {GATEWAY_PROFILE}"]
+        lines += [
+            f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+            for name, value in report.items()
+        ]
+        lines.append(f"top_events: {top_events or '-'}")
+        await ctx.send("\n".join(lines))
+
+    # Profiling, restricted to the users listed in ADMIN_USER_IDS
+    def is_admin(ctx) -> bool:
+        return ctx.author.id in ADMIN_USER_IDS
+
+    # PROFILE
+    @bot.command(name="profile", help="-Starts or stops a CPU profile (admins)")
+    @commands.check(is_admin)
+    async def profile(ctx, action: str = "start") -> None:
+        """Samples the event loop's stack until stopped, then dumps the stacks
 
-        # Check the state of the bot is it Idle or Engaged and
-        # send the message accordingly
-        if global_state == BotState.IDLE:
-            await ctx.send("Idle")
+        Args:
+            ctx (Unknown): The context of the command
+            action (str): "start" or "stop"
+        """
+        nonlocal cpu_profiler
+
+        if action == "start":
+            if cpu_profiler is not None and cpu_profiler.running:
+                await ctx.send("A CPU profile is already running")
+                return
+            cpu_profiler = SamplingProfiler()  # Called on the event loop's thread
+            cpu_profiler.start()
+            await ctx.send("CPU profile started, `!profile stop` to end it")
+        elif action == "stop":
+            if cpu_profiler is None or not cpu_profiler.running:
+                await ctx.send("No CPU profile is running")
+                return
+            path = await asyncio.to_thread(cpu_profiler.stop, PROFILE_DIR)
+            top = "\n".join(
+                f"{share:6.1%} {frame}" for frame, share in cpu_profiler.top()
+            )
+            await ctx.send(f"CPU profile written to `{path}`\n```{top[:1800] or '-'}```")
         else:
-            await ctx.send("Engaged")
+            await ctx.send("Usage: `!profile start` or `!profile stop`")
+
+    # MEMORY
+    @bot.command(name="memory", help="-Dumps a memory snapshot (admins)")
+    @commands.check(is_admin)
+    async def memory(ctx, action: str = "snapshot") -> None:
+        """Dumps a tracemalloc snapshot and reports what grew since the last one
+
+        Args:
+            ctx (Unknown): The context of the command
+            action (str): "snapshot", or "stop" to end tracing
+        """
+        if action == "stop":
+            memory_profiler.stop()
+            await ctx.send("Memory tracing stopped")
+            return
+        path, stats = await asyncio.to_thread(memory_profiler.snapshot, PROFILE_DIR)
+        lines = "\n".join(stats)[:1800]
+        await ctx.send(f"Memory snapshot written to `{path}`\n```{lines or '-'}```")
+
+    # LOOP
+    @bot.command(name="loop", help="-Reports event loop lag and slow calls (admins)")
+    @commands.check(is_admin)
+    async def loop(ctx, debug: Optional[str] = None) -> None:
+        """Reports the event loop's lag and recent slow callbacks
+
+        Args:
+            ctx (Unknown): The context of the command
+            debug (Optional[str]): "on" or "off" to toggle slow-callback reports
+        """
+        if debug in ("on", "off"):
+            loop_monitor.set_debug(debug == "on")
+        lines = "\n".join(loop_monitor.report())[:1900]
+        await ctx.send(f"```{lines}```")
+
+    # Doctor reports, restricted to the users listed in DOCTOR_USER_IDS and admins
+    def is_doctor(ctx) -> bool:
+        return ctx.author.id in DOCTOR_USER_IDS or ctx.author.id in ADMIN_USER_IDS
+
+    # REPORT
+    @bot.command(name="report", help="-Prompts the report of a patient (doctors)")
+    @commands.check(is_doctor)
+    async def report(ctx, user: discord.User) -> None:
+        """Prompts the latest report written for the doctor of a user
+
+        Args:
+            ctx (Unknown): The context of the command
+            user (discord.User): The patient
+        """
+        record = get_doctor_report(user.id)
+        pending = report_queue.pending(user.id)
+        if record is None:
+            status = "being written" if pending else "not available yet"
+            await ctx.send(f"The report of {user.mention} is {status}")
+            return
+
+        minutes = (time.time() - record["generated_at"]) / 60
+        header = f"Report of {user.mention}, written {minutes:.0f} min ago"
+        if pending:
+            header += ", a newer one is being written"
+        await ctx.send(f"{header}\n```{record['report'][:1800]}```")
 
     return bot
 
 
+def end_conversation(user_id: int, channel_id: int) -> None:
+    """Close the user's session and forget the conversation, not the user data
+
+    Args:
+        user_id (int): ID of the user
+        channel_id (int): Channel of the conversation
+    """
+    sessions.close(user_id)
+    clear_chat_history(user_id, channel_id)
+    clear_conversation_summary(user_id)
+
+
 def change_chat_history(
     user_chat_history: List[Tuple[str, str]],
 ) -> List[str]:
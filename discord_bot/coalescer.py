@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from chatbot.metrics import ERRORS
+from discord_bot.parameters import COALESCE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Produces the answer to the merged messages, may be cancelled
+Compute = Callable[[str], Awaitable[Any]]
+# Applies the answer (state updates, replies), never cancelled
+Commit = Callable[[str, Any], Awaitable[None]]
+
+
+class MessageCoalescer:
+    """Serializes and merges the messages of each user
+
+    Messages of a key, usually the user ID, wait ``window`` seconds
+    for more to arrive and are then answered together by a single request.
+    A message that arrives while the previous request is still computing
+    cancels it and is merged with the messages it was answering. Once a
+    request has its answer it commits under the key's lock, so state writes
+    of the same user never interleave.
+
+    Args:
+        window (float): Debounce window in seconds
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW) -> None:
+        self.window = window
+        # Unanswered messages of each key and when they arrived, oldest first
+        self._pending: Dict[Hashable, List[Tuple[str, float]]] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def submit(
+        self,
+        key: Hashable,
+        text: str,
+        compute: Compute,
+        commit: Commit,
+        received_at: Optional[float] = None,
+    ) -> None:
+        """Queue a message, superseding the request still working on the key
+
+        Args:
+            key (Hashable): Whose conversation the message belongs to
+            text (str): The message
+            compute (Compute): Produces the answer to the merged messages
+            commit (Commit): Applies the answer
+            received_at (Optional[float]): time.perf_counter() when the
+                message arrived, now by default
+        """
+        if received_at is None:
+            received_at = time.perf_counter()
+        self._pending.setdefault(key, []).append((text, received_at))
+
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            task.cancel()  # Its messages stay pending and are merged into ours
+        self._tasks[key] = asyncio.create_task(self._run(key, compute, commit))
+
+    def pending(self, key: Hashable) -> int:
+        """Number of messages of a key that have not been answered yet"""
+        return len(self._pending.get(key, ()))
+
+    def received_at(self, key: Hashable) -> Optional[float]:
+        """When the oldest unanswered message of a key arrived
+
+        Called from ``compute``, this is the oldest message being answered.
+        """
+        pending = self._pending.get(key)
+        return pending[0][1] if pending else None
+
+    def _consume(self, key: Hashable, count: int) -> None:
+        """Mark the oldest messages of a key as answered by the current task"""
+        if self._tasks.get(key) is asyncio.current_task():
+            del self._tasks[key]
+        pending = self._pending[key]
+        del pending[:count]
+        if not pending:
+            del self._pending[key]
+
+    async def _run(self, key: Hashable, compute: Compute, commit: Commit) -> None:
+        await asyncio.sleep(self.window)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                texts = [text for text, _ in self._pending.get(key, ())]
+                if not texts:
+                    return
+                merged = "\n".join(texts)
+                try:
+                    result = await compute(merged)
+                except Exception:
+                    # Drop the messages rather than retrying them with every new one
+                    self._consume(key, len(texts))
+                    ERRORS.inc(stage="compute")
+                    logger.exception("Answering %s failed", key)
+                    return
+
+                # From here on the answer is final, newer messages queue behind it
+                self._consume(key, len(texts))
+                try:
+                    await asyncio.shield(commit(merged, result))
+                except Exception:
+                    ERRORS.inc(stage="commit")
+                    logger.exception("Committing the answer to %s failed", key)
+        finally:
+            if key not in self._tasks and key not in self._pending:
+                self._locks.pop(key, None)
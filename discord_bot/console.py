@@ -0,0 +1,200 @@
+import asyncio
+import itertools
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import discord
+
+HELP = """Commands:
+  list                 Pending mentions, oldest first
+  reply <id> <text>    Reply to a pending mention
+  <text>               Reply to the oldest pending mention
+  drop <id>            Forget a pending mention without replying
+  exit                 Shut the bot down"""
+
+
+def _age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+class PendingMention:
+    """A mention of the bot waiting for the operator
+
+    Args:
+        mention_id (int): ID the operator refers to the mention by
+        message (discord.Message): The message that mentions the bot
+    """
+
+    def __init__(self, mention_id: int, message: discord.Message) -> None:
+        self.id = mention_id
+        self.message = message
+        self.received_at = time.monotonic()
+
+    def preview(self, length: int = 60) -> str:
+        content = " ".join(self.message.clean_content.split())
+        if len(content) > length:
+            content = content[: length - 3] + "..."
+        return f"#{self.message.channel} {self.message.author}: {content}"
+
+
+class OperatorConsole:
+    """Lets an operator answer the mentions of a bot from the terminal
+
+    Mentions wait in a backlog under short IDs, so the operator can answer
+    them in any order and in any channel, while new mentions keep arriving.
+    Piped standard input is read on the event loop through a pipe
+    transport, no thread blocks on ``input()``. A terminal, or a stdin that
+    cannot be connected as a pipe, e.g. a Windows console, is read by a
+    single thread that feeds the loop instead: the pipe transport makes
+    stdin non-blocking, which a terminal shares with stdout, so large prints
+    could fail and the terminal would stay non-blocking after exit.
+
+    Args:
+        bot (discord.Client): The bot whose mentions are answered
+    """
+
+    def __init__(self, bot: discord.Client) -> None:
+        self.bot = bot
+        self.pending: "OrderedDict[int, PendingMention]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, message: discord.Message) -> PendingMention:
+        """Put a mention in the backlog and announce it
+
+        Args:
+            message (discord.Message): The message that mentions the bot
+
+        Returns:
+            PendingMention: The backlog entry
+        """
+        mention = PendingMention(next(self._ids), message)
+        self.pending[mention.id] = mention
+        print(f"[{mention.id}] {mention.preview()} ({self.status()})")
+        return mention
+
+    def status(self) -> str:
+        """Queue depth and age of the oldest pending mention"""
+        if not self.pending:
+            return "no pending mentions"
+        oldest = next(iter(self.pending.values()))
+        age = _age(time.monotonic() - oldest.received_at)
+        return f"{len(self.pending)} pending, oldest {age}"
+
+    def list(self) -> None:
+        """Print the backlog, oldest first"""
+        now = time.monotonic()
+        for mention in self.pending.values():
+            print(
+                f"[{mention.id}] {_age(now - mention.received_at):>5} "
+                f"{mention.preview()}"
+            )
+        print(self.status())
+
+    async def reply(self, mention_id: int, text: str) -> None:
+        """Answer a pending mention and take it off the backlog
+
+        Args:
+            mention_id (int): ID of the mention
+            text (str): The reply
+        """
+        mention = self.pending.pop(mention_id, None)
+        if mention is None:
+            print(f"No pending mention {mention_id}")
+            return
+        try:
+            await mention.message.reply(text)
+        except discord.HTTPException as e:
+            self.pending[mention_id] = mention  # Keep it for another try
+            self.pending.move_to_end(mention_id, last=False)
+            print(f"Replying to [{mention_id}] failed: {e}")
+            return
+        print(f"Replied to [{mention_id}] ({self.status()})")
+
+    async def handle(self, line: str) -> bool:
+        """Run one command line
+
+        Args:
+            line (str): The line typed by the operator
+
+        Returns:
+            bool: False once the operator asked to exit
+        """
+        command, _, argument = line.strip().partition(" ")
+        command = command.lower()
+        if not command:
+            return True
+        if command == "exit":
+            return False
+
+        if command == "help":
+            print(HELP)
+        elif command == "list":
+            self.list()
+        elif command in ("reply", "drop"):
+            mention_id, _, text = argument.strip().partition(" ")
+            if not mention_id.isdigit():
+                usage = "reply <id> <text>" if command == "reply" else "drop <id>"
+                print(f"Usage: {usage}")
+            elif command == "drop":
+                if self.pending.pop(int(mention_id), None) is None:
+                    print(f"No pending mention {mention_id}")
+                else:
+                    print(f"Dropped [{mention_id}] ({self.status()})")
+            elif text.strip():
+                await self.reply(int(mention_id), text.strip())
+            else:
+                print("Nothing to reply")
+        elif self.pending:
+            await self.reply(next(iter(self.pending)), line.strip())
+        else:
+            print("No pending mentions, type help for the commands")
+        return True
+
+    async def _stdin_reader(self) -> asyncio.StreamReader:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+
+        # One thread for the whole session, not one per line
+        def feed() -> None:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(reader.feed_data, line.encode())
+            loop.call_soon_threadsafe(reader.feed_eof)
+
+        if not sys.stdin.isatty():
+            try:
+                await loop.connect_read_pipe(
+                    lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+                )
+                return reader
+            except (NotImplementedError, ValueError, OSError):
+                pass
+        threading.Thread(target=feed, name="console-stdin", daemon=True).start()
+        return reader
+
+    async def _run(self) -> None:
+        reader = await self._stdin_reader()
+        print(f"Operator console ready, type help for the commands ({self.status()})")
+        while True:
+            line = await reader.readline()
+            if not line:
+                # Detached from the terminal, the bot keeps running
+                print("Standard input closed, the operator console stops")
+                return
+            if not await self.handle(line.decode(errors="replace")):
+                break
+        print("Shutting down bot...")
+        await self.bot.close()
+
+    def start(self) -> None:
+        """Start reading commands on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
@@ -1,31 +1,27 @@
-import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import os
-import asyncio
+
+from discord_bot.console import OperatorConsole
+from discord_bot.gateway import gateway_options
+from discord_bot.parameters import GATEWAY_PROFILE
 
 load_dotenv()
 
 TOKEN = os.getenv("DISCORD_TOKEN", "Enter your discord token")
 
-# Set up intents once
-intents = discord.Intents.all()
-intents.message_content = True  # Needed to read message content
-intents.guilds = True
-intents.messages = True
-
-# Create bot with command prefix
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Create bot with command prefix, intents and caches as set by GATEWAY_PROFILE
+bot = commands.Bot(command_prefix="!", **gateway_options(GATEWAY_PROFILE))
 
-# Queue to keep track of which channel to reply in
-pending_channels = asyncio.Queue()
+# Backlog of the mentions the operator answers from the terminal
+console = OperatorConsole(bot)
 
 
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
-    # Start background task to read terminal input
-    asyncio.create_task(read_from_terminal())
+    # Start reading the operator's commands
+    console.start()
 
 
 @bot.event
@@ -34,27 +30,10 @@ async def on_message(message):
         return  # Avoid responding to itself
 
     if bot.user in message.mentions:
-        print(f"Bot was pinged in #{message.channel} by {message.author}")
-        await pending_channels.put(message.channel)
+        console.add(message)
 
     await bot.process_commands(message)  # Important for handling commands
 
 
-async def read_from_terminal():
-    while True:
-        channel = await pending_channels.get()
-        user_input = await asyncio.get_event_loop().run_in_executor(
-            None, input, "Reply to mention: "
-        )
-
-        if user_input.strip().lower() == "exit":
-            print("Shutting down bot...")
-            await bot.close()
-            break
-
-        if channel:
-            await channel.send(user_input)
-
-
 # Start the bot
 bot.run(TOKEN)
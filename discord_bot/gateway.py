@@ -0,0 +1,91 @@
+import time
+from collections import Counter
+from typing import Any, Dict
+
+import discord
+
+from discord_bot.parameters import MESSAGE_CACHE_SIZE
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def gateway_options(profile: str) -> Dict[str, Any]:
+    """Intents and cache settings of the bot for a gateway profile
+
+    The "minimal" profile only subscribes to guild and direct messages, so
+    presence, member and typing events are never sent, and it does not cache
+    or chunk members.
+
+    Args:
+        profile (str): "minimal" or "full"
+
+    Returns:
+        Dict[str, Any]: Keyword arguments for commands.Bot
+    """
+    if profile == "full":
+        return {"intents": discord.Intents.all()}
+    if profile != "minimal":
+        raise ValueError(f"Unknown gateway profile: {profile}")
+
+    intents = discord.Intents.none()
+    intents.guilds = True  # Guild and channel cache, messages resolve their channel from it
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True  # Privileged, needed to read what users write
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "max_messages": MESSAGE_CACHE_SIZE or None,
+        "chunk_guilds_at_startup": False,
+    }
+
+
+class GatewayStats:
+    """Counts gateway events and reports cache sizes, to compare profiles"""
+
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.events: Counter = Counter()
+
+    def attach(self, bot: discord.Client) -> None:
+        """Count the events the bot receives from now on
+
+        Args:
+            bot (discord.Client): The bot
+        """
+        bot.add_listener(self.record, "on_socket_event_type")
+
+    async def record(self, event_type: str) -> None:
+        self.events[event_type] += 1
+
+    def report(self, bot: discord.Client) -> Dict[str, Any]:
+        """Event rates since the bot started and the current cache sizes
+
+        Args:
+            bot (discord.Client): The bot
+
+        Returns:
+            Dict[str, Any]: Events in total and per second, the five most
+                frequent event types, cached guilds, users, members and
+                messages, and the peak resident memory in MB
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        total = sum(self.events.values())
+        report = {
+            "events": total,
+            "events_per_second": total / elapsed,
+            "top_events": {
+                event: count / elapsed for event, count in self.events.most_common(5)
+            },
+            "guilds": len(bot.guilds),
+            "users": len(bot.users),
+            "members": sum(len(guild.members) for guild in bot.guilds),
+            "messages": len(bot.cached_messages),
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return report
@@ -1,60 +1,292 @@
-from typing import List, Tuple
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from discord_bot.parameters import (
+    CHAT_HISTORY_LIMIT,
+    STORAGE_CACHE_SIZE,
+    STORAGE_FLUSH_INTERVAL,
+)
+from discord_bot.storage import MemoryBackend, StorageBackend, WriteBehindStore
 
-chat_history: List[Tuple[str, str]] = []  # Stores the tuple of  (user_id, message)
-active_users: List[str] = []  # Stores the user_id of active users
 bot_id: str = "Replace"  # Bot ID
+# Channels the bot was mentioned in by this process, other channels only
+# matter when the bot is mentioned there
+tracked_channels: Set[int] = set()
+
+# Namespaces of the records kept in the store
+USER_DATA = "user"  # User personal data
+MEDICAL_DATA = "medical"  # User medical data
+CONVERSATION_SUMMARY = "summary"  # Rolling summary of each user's older chat turns
+CHAT_TURNS = "turns"  # Chat turns, when shared between processes or offloaded
+SESSION = "session"  # Phase of each user's ongoing conversation
+DOCTOR_REPORT = "report"  # Latest report for the doctor of each user
+
+# Namespaces keyed by user ID
+USER_NAMESPACES = (
+    USER_DATA,
+    MEDICAL_DATA,
+    CONVERSATION_SUMMARY,
+    SESSION,
+    DOCTOR_REPORT,
+)
+# Namespaces of the conversation only, dropped when a session expires for good
+CONVERSATION_NAMESPACES = (CONVERSATION_SUMMARY, SESSION)
+
+# Hot cache over the storage backend, in-process only until configure_storage
+store = WriteBehindStore(MemoryBackend())
+
+
+class ConversationStore:
+    """Per-user conversation buffers backed by bounded deques
+
+    Each (user_id, channel_id) pair owns its own deque, so appending and
+    evicting a turn is O(1) and reading one user's history is O(k) in the
+    size of that user's buffer, independent of how busy the server is.
+
+    Buffers of idle users can be offloaded to a durable store backend, they
+    are loaded back the next time the user's conversation is read.
+
+    Args:
+        limit (int): Maximum number of turns kept per user and channel
+    """
+
+    def __init__(self, limit: int = CHAT_HISTORY_LIMIT) -> None:
+        self.limit = limit
+        self._buffers: Dict[Tuple[int, Optional[int]], Deque[Tuple[str, str]]] = {}
+        # Channels each user has a buffer in, so a user's buffers are found
+        # without scanning every buffer
+        self._channels: Dict[int, Set[Optional[int]]] = {}
+
+    def _key(self, user_id: int, channel_id: Optional[int]) -> str:
+        return f"{user_id}:{channel_id}"
+
+    def _buffer(
+        self, user_id: int, channel_id: Optional[int], create: bool = False
+    ) -> Optional[Deque[Tuple[str, str]]]:
+        key = (user_id, channel_id)
+        buffer = self._buffers.get(key)
+        if buffer is not None:
+            return buffer
+
+        turns = None
+        if store.backend.durable:
+            # Offloaded while the user was idle, the buffer owns them again
+            turns = store.get(CHAT_TURNS, self._key(user_id, channel_id))
+            if turns:
+                store.delete(CHAT_TURNS, self._key(user_id, channel_id))
+        if not turns and not create:
+            return None
+        buffer = self._buffers[key] = deque(
+            (tuple(turn) for turn in turns or ()), maxlen=self.limit
+        )
+        self._channels.setdefault(user_id, set()).add(channel_id)
+        return buffer
+
+    def append(
+        self, user_id: int, role: str, message: str, channel_id: Optional[int] = None
+    ) -> None:
+        """Append a turn, evicting the oldest one once the limit is reached
+
+        Args:
+            user_id (int): User ID
+            role (str): Who sent the message, "user" or "assistant"
+            message (str): Message
+            channel_id (Optional[int]): Channel the conversation happens in
+        """
+        self._buffer(user_id, channel_id, create=True).append((role, message))
+
+    def get(
+        self, user_id: int, channel_id: Optional[int] = None
+    ) -> List[Tuple[str, str]]:
+        """Get the turns of a user, oldest first
+
+        Args:
+            user_id (int): User ID
+            channel_id (Optional[int]): Channel the conversation happens in
+
+        Returns:
+            List[Tuple[str, str]]: List of (role, message) turns
+        """
+        return list(self._buffer(user_id, channel_id) or ())
+
+    def drop_oldest(
+        self, user_id: int, count: int, channel_id: Optional[int] = None
+    ) -> None:
+        """Drop the oldest turns of a user, e.g. once they have been summarized
+
+        Args:
+            user_id (int): User ID
+            count (int): Number of turns to drop
+            channel_id (Optional[int]): Channel the conversation happens in
+        """
+        buffer = self._buffer(user_id, channel_id)
+        if buffer is None:
+            return
+        for _ in range(min(count, len(buffer))):
+            buffer.popleft()
+
+    def clear(self, user_id: int, channel_id: Optional[int] = None) -> None:
+        """Drop the turns of a user
+
+        Args:
+            user_id (int): User ID
+            channel_id (Optional[int]): Channel the conversation happens in
+        """
+        self._buffers.pop((user_id, channel_id), None)
+        channels = self._channels.get(user_id)
+        if channels is not None:
+            channels.discard(channel_id)
+            if not channels:
+                del self._channels[user_id]
+        if store.backend.durable:
+            store.delete(CHAT_TURNS, self._key(user_id, channel_id))
+
+    def offload(self, user_id: int) -> None:
+        """Move every buffer of a user to the store backend
+
+        Args:
+            user_id (int): User ID
+        """
+        for channel_id in self._channels.pop(user_id, ()):
+            buffer = self._buffers.pop((user_id, channel_id))
+            store.put(CHAT_TURNS, self._key(user_id, channel_id), list(buffer))
+            store.evict(CHAT_TURNS, self._key(user_id, channel_id))
+
+    def forget(self, user_id: int) -> None:
+        """Drop every buffer of a user
+
+        Args:
+            user_id (int): User ID
+        """
+        for channel_id in self._channels.pop(user_id, ()):
+            self._buffers.pop((user_id, channel_id), None)
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+
+class StoredConversationStore(ConversationStore):
+    """Conversation buffers kept in the storage backend
+
+    Used when several processes serve the same users, so that any of them
+    can continue a conversation. Each buffer is one bounded record.
+
+    Args:
+        limit (int): Maximum number of turns kept per user and channel
+    """
 
-CHAT_HISTORY_LIMIT = 100
+    def append(
+        self, user_id: int, role: str, message: str, channel_id: Optional[int] = None
+    ) -> None:
+        turns = self.get(user_id, channel_id)[-(self.limit - 1) :] if self.limit > 1 else []
+        turns.append((role, message))
+        store.put(CHAT_TURNS, self._key(user_id, channel_id), turns)
 
-# Dictionary to store user personal data
-user_data = {}
+    def get(
+        self, user_id: int, channel_id: Optional[int] = None
+    ) -> List[Tuple[str, str]]:
+        turns = store.get(CHAT_TURNS, self._key(user_id, channel_id)) or []
+        return [tuple(turn) for turn in turns]
 
-# Dictionary to store user medical data
-medical_data = {}
+    def drop_oldest(
+        self, user_id: int, count: int, channel_id: Optional[int] = None
+    ) -> None:
+        turns = self.get(user_id, channel_id)
+        if turns:
+            store.put(CHAT_TURNS, self._key(user_id, channel_id), turns[count:])
 
+    def clear(self, user_id: int, channel_id: Optional[int] = None) -> None:
+        store.delete(CHAT_TURNS, self._key(user_id, channel_id))
 
-def get_user_chat_history(user_id: str) -> List[str]:
+    def offload(self, user_id: int) -> None:
+        pass  # Already in the store backend, the hot cache is bypassed
+
+    def forget(self, user_id: int) -> None:
+        pass  # Other processes may still serve the user
+
+
+# Stores the conversation turns of every user, keyed by (user_id, channel_id)
+conversations = ConversationStore()
+
+
+def get_user_chat_history(
+    user_id: int, channel_id: Optional[int] = None
+) -> List[Tuple[str, str]]:
     """Get the chat history of a user
 
     Args:
-        user_id (str): User ID
+        user_id (int): User ID
+        channel_id (Optional[int]): Channel ID
 
     Returns:
-        List[str]: List of messages
+        List[Tuple[str, str]]: List of (role, message) turns
     """
-    return [msg for uid, msg in chat_history if uid == user_id]
+    return conversations.get(user_id, channel_id)
 
 
-def add_to_chat_history(user_id: str, message: str) -> None:
-    """Add a message to the chat history
+def add_to_chat_history(
+    user_id: int, message: str, channel_id: Optional[int] = None, role: str = "user"
+) -> None:
+    """Add a message to the chat history of a user
 
     Args:
-        user_id (str): User ID
+        user_id (int): User ID
         message (str): Message
+        channel_id (Optional[int]): Channel ID
+        role (str): Who sent the message, "user" or "assistant"
+    """
+    conversations.append(user_id, role, message, channel_id)
+
+
+def trim_chat_history(
+    user_id: int, count: int, channel_id: Optional[int] = None
+) -> None:
+    """Remove the oldest messages from the chat history of a user
+
+    Args:
+        user_id (int): User ID
+        count (int): Number of messages to remove
+        channel_id (Optional[int]): Channel ID
     """
-    if len(chat_history) >= CHAT_HISTORY_LIMIT:
-        chat_history.pop(0)
-    chat_history.append((user_id, message))
+    conversations.drop_oldest(user_id, count, channel_id)
 
 
-def set_user_active(user_id: str) -> None:
-    """Set the user as active
+def clear_chat_history(user_id: int, channel_id: Optional[int] = None) -> None:
+    """Clear the chat history of a user
 
     Args:
-        user_id (str): User ID
+        user_id (int): User ID
+        channel_id (Optional[int]): Channel ID
     """
-    if user_id not in active_users:
-        active_users.append(user_id)
+    conversations.clear(user_id, channel_id)
 
 
-def set_user_inactive(user_id: str) -> None:
-    """Set the user as inactive
+def configure_storage(
+    backend: StorageBackend,
+    flush_interval: float = STORAGE_FLUSH_INTERVAL,
+    cache_size: int = STORAGE_CACHE_SIZE,
+    shared: bool = False,
+) -> None:
+    """Put a storage backend behind the user, medical and summary data
 
     Args:
-        user_id (str): User ID
+        backend (StorageBackend): The backend, e.g. a SQLiteBackend
+        flush_interval (float): Seconds between two background flushes
+        cache_size (int): Number of records kept in the hot cache
+        shared (bool): Whether other processes serve the same users, chat
+            turns then move to the backend and reads skip the hot cache
     """
-    if user_id in active_users:
-        active_users.remove(user_id)
+    global store, conversations
+    store.close()
+    store = WriteBehindStore(backend, flush_interval, cache_size, shared)
+    store.start()
+    if shared:
+        conversations = StoredConversationStore()
+
+
+def close_storage() -> None:
+    """Flush the pending writes and close the storage backend"""
+    store.close()
 
 
 def get_user_data(user_id: int) -> dict:
@@ -66,7 +298,7 @@ def get_user_data(user_id: int) -> dict:
     Returns:
         Dictionary containing user's personal data
     """
-    return user_data.get(user_id, {})
+    return store.get(USER_DATA, user_id) or {}
 
 
 def update_user_data(user_id: int, data: dict) -> None:
@@ -76,9 +308,7 @@ def update_user_data(user_id: int, data: dict) -> None:
         user_id: Discord user ID
         data: Dictionary containing updated user data
     """
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    user_data[user_id].update(data)
+    store.put(USER_DATA, user_id, {**get_user_data(user_id), **data})
 
 
 def clear_user_data(user_id: int) -> None:
@@ -87,8 +317,7 @@ def clear_user_data(user_id: int) -> None:
     Args:
         user_id: Discord user ID
     """
-    if user_id in user_data:
-        del user_data[user_id]
+    store.delete(USER_DATA, user_id)
 
 
 def get_medical_data(user_id: int) -> dict:
@@ -100,7 +329,7 @@ def get_medical_data(user_id: int) -> dict:
     Returns:
         Dictionary containing user's medical data
     """
-    return medical_data.get(user_id, {})
+    return store.get(MEDICAL_DATA, user_id) or {}
 
 
 def update_medical_data(user_id: int, data: dict) -> None:
@@ -110,9 +339,71 @@ def update_medical_data(user_id: int, data: dict) -> None:
         user_id: Discord user ID
         data: Dictionary containing updated medical data
     """
-    if user_id not in medical_data:
-        medical_data[user_id] = {}
-    medical_data[user_id].update(data)
+    store.put(MEDICAL_DATA, user_id, {**get_medical_data(user_id), **data})
+
+
+def merge_list_patch(items: List[Any], patch: Dict[str, Any]) -> List[Any]:
+    """Apply the changes of a list patch to a list.
+
+    Replacements and removals refer to positions in ``items``, so they are
+    applied before the appended items shift anything. Out of range positions
+    and appended items that are already in the list are ignored.
+
+    Args:
+        items: The stored list
+        patch: The append, replace and remove changes
+
+    Returns:
+        The patched list, ``items`` is left unchanged
+    """
+    items = list(items)
+    for replacement in patch.get("replace") or ():
+        if 0 <= replacement["index"] < len(items):
+            items[replacement["index"]] = replacement["value"]
+    removed = set(patch.get("remove") or ())
+    if removed:
+        items = [item for index, item in enumerate(items) if index not in removed]
+    for item in patch.get("append") or ():
+        if item not in items:
+            items.append(item)
+    return items
+
+
+def merge_medical_patch(medical_data: dict, patch: dict) -> dict:
+    """Apply a triage patch to a medical record.
+
+    List fields take a list patch, a plain list replaces the stored one.
+    Empty strings leave a field unchanged.
+
+    Args:
+        medical_data: The stored medical data
+        patch: The changes returned by the triage
+
+    Returns:
+        The patched medical data, ``medical_data`` is left unchanged
+    """
+    merged = dict(medical_data)
+    for field, value in patch.items():
+        if isinstance(value, dict):
+            merged[field] = merge_list_patch(merged.get(field) or [], value)
+        elif value != "":
+            merged[field] = value
+    return merged
+
+
+def patch_medical_data(user_id: int, patch: dict) -> dict:
+    """Apply a triage patch to user's medical diagnosis data.
+
+    Args:
+        user_id: Discord user ID
+        patch: The changes returned by the triage
+
+    Returns:
+        The patched medical data
+    """
+    medical_data = merge_medical_patch(get_medical_data(user_id), patch)
+    store.put(MEDICAL_DATA, user_id, medical_data)
+    return medical_data
 
 
 def clear_medical_data(user_id: int) -> None:
@@ -121,5 +412,125 @@ def clear_medical_data(user_id: int) -> None:
     Args:
         user_id: Discord user ID
     """
-    if user_id in medical_data:
-        del medical_data[user_id]
+    store.delete(MEDICAL_DATA, user_id)
+
+
+def get_conversation_summary(user_id: int) -> str:
+    """Get the rolling summary of a user's older chat turns.
+
+    Args:
+        user_id: Discord user ID
+
+    Returns:
+        The summary, empty if nothing has been summarized yet
+    """
+    return store.get(CONVERSATION_SUMMARY, user_id) or ""
+
+
+def update_conversation_summary(user_id: int, summary: str) -> None:
+    """Replace the rolling summary of a user's older chat turns.
+
+    Args:
+        user_id: Discord user ID
+        summary: The updated summary
+    """
+    store.put(CONVERSATION_SUMMARY, user_id, summary)
+
+
+def clear_conversation_summary(user_id: int) -> None:
+    """Clear the rolling summary of a user's older chat turns.
+
+    Args:
+        user_id: Discord user ID
+    """
+    store.delete(CONVERSATION_SUMMARY, user_id)
+
+
+def get_doctor_report(user_id: int) -> Optional[Dict[str, Any]]:
+    """Get the latest doctor report of a user.
+
+    Args:
+        user_id: Discord user ID
+
+    Returns:
+        The report and when it was generated, None if there is none yet
+    """
+    return store.get(DOCTOR_REPORT, user_id)
+
+
+def update_doctor_report(user_id: int, report: Dict[str, Any]) -> None:
+    """Replace the doctor report of a user.
+
+    Args:
+        user_id: Discord user ID
+        report: The report and when it was generated
+    """
+    store.put(DOCTOR_REPORT, user_id, report)
+
+
+def clear_doctor_report(user_id: int) -> None:
+    """Clear the doctor report of a user.
+
+    Args:
+        user_id: Discord user ID
+    """
+    store.delete(DOCTOR_REPORT, user_id)
+
+
+def get_session_record(user_id: int) -> Optional[Dict[str, Any]]:
+    """Get the stored session of a user.
+
+    Args:
+        user_id: Discord user ID
+
+    Returns:
+        The session as a dictionary, None if the user has no open session
+    """
+    return store.get(SESSION, user_id)
+
+
+def update_session_record(user_id: int, record: Dict[str, Any]) -> None:
+    """Store the session of a user.
+
+    Args:
+        user_id: Discord user ID
+        record: The session as a dictionary
+    """
+    store.put(SESSION, user_id, record)
+
+
+def clear_session_record(user_id: int) -> None:
+    """Remove the stored session of a user.
+
+    Args:
+        user_id: Discord user ID
+    """
+    store.delete(SESSION, user_id)
+
+
+def offload_user(user_id: int) -> None:
+    """Move a user's records out of memory, they are reloaded when needed.
+
+    Only frees memory with a durable backend, the hot cache is the only
+    copy of the records otherwise.
+
+    Args:
+        user_id: Discord user ID
+    """
+    conversations.offload(user_id)
+    for namespace in USER_NAMESPACES:
+        store.evict(namespace, user_id)
+
+
+def forget_user(user_id: int) -> None:
+    """Drop the conversation of a user: chat turns, summary and session.
+
+    The personal details, the medical record and the doctor report are
+    kept, the doctor may not have seen them yet.
+
+    Args:
+        user_id: Discord user ID
+    """
+    conversations.forget(user_id)
+    for namespace in CONVERSATION_NAMESPACES:
+        store.delete(namespace, user_id)
@@ -1,3 +1,83 @@
 import os
 
+from dotenv import load_dotenv
+
+# Read .env before the settings below, whichever module imports this first
+load_dotenv()
+
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN", "replace with actual key")
+
+# Maximum number of conversation turns kept per user and channel
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "50"))
+
+# Storage backend for user and medical data: "sqlite", or "memory", which
+# keeps the records of every user in memory until the bot restarts
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "doc_room.db")
+# Seconds between two background flushes of the write-behind cache
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "1.0"))
+# Number of records kept in the in-memory hot cache
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", "10000"))
+
+# Stream diagnosis replies into a message that is edited as tokens arrive
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+# Minimum seconds between two edits of a streamed message, Discord allows
+# about five edits per five seconds on a channel
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Seconds to wait for more messages from a user before answering them together
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0.5"))
+
+# Seconds without a message after which a session expires, 0 disables expiry
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "21600"))
+# Seconds between two sweeps for expired sessions
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# Sessions kept in memory, the least recently active is evicted beyond it
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+# Whether expired and evicted sessions are offloaded to the storage backend
+# and resumed when the user returns, instead of being forgotten. Requires a
+# durable backend
+SESSION_OFFLOAD = os.getenv("SESSION_OFFLOAD", "true").lower() == "true"
+
+# Gateway shards, Discord's recommendation when 0
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+# Worker processes the shards are spread over, each runs its own event loop.
+# More than one requires the sqlite storage backend, which holds the state
+# the processes share
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))
+
+# Gateway intents and caches: "minimal" requests only what the handlers use,
+# "full" requests every intent and caches members like before
+GATEWAY_PROFILE = os.getenv("GATEWAY_PROFILE", "minimal")
+# Messages kept in discord.py's message cache by the minimal profile, 0 disables it
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "100"))
+
+# Level of the logs, and whether message and model payloads are logged too
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+
+# Port of the local Prometheus metrics endpoint, 0 disables it. Worker
+# processes of a sharded bot listen on the following ports
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Discord user IDs allowed to run the profiling commands, comma separated
+ADMIN_USER_IDS = {
+    int(user_id)
+    for user_id in os.getenv("ADMIN_USER_IDS", "").split(",")
+    if user_id.strip()
+}
+# Directory the profiling commands write their results to
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Discord user IDs allowed to pull doctor reports, comma separated, admins
+# may too
+DOCTOR_USER_IDS = {
+    int(user_id)
+    for user_id in os.getenv("DOCTOR_USER_IDS", "").split(",")
+    if user_id.strip()
+}
+# Workers generating doctor reports in the background, and the reports that
+# may wait for one before new requests are dropped
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "100"))
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+
+def _output_path(directory: str, prefix: str, extension: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    name = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{extension}"
+    return os.path.join(directory, name)
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread, usually the event loop's
+
+    A background thread reads the target thread's current frame every
+    ``interval`` seconds, so the profiled code runs unmodified and the
+    overhead stays low enough for production. Stacks are written in the
+    collapsed format that flamegraph.pl and speedscope read.
+
+    Args:
+        thread_id (int): Thread to sample, the calling thread by default
+        interval (float): Seconds between two samples
+    """
+
+    def __init__(
+        self, thread_id: Optional[int] = None, interval: float = 0.005
+    ) -> None:
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.started_at = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        if stack:
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        """Start sampling"""
+        if self.running:
+            return
+        self.samples.clear()
+        self.started_at = time.monotonic()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, directory: str) -> str:
+        """Stop sampling and write the collapsed stacks
+
+        Args:
+            directory (str): Directory of the output file
+
+        Returns:
+            str: Path of the output file
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        path = _output_path(directory, "cpu", "folded")
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return path
+
+    def top(self, limit: int = 5) -> List[Tuple[str, float]]:
+        """Frames that were running in the most samples, own time only
+
+        Returns:
+            List[Tuple[str, float]]: Frame and share of the samples
+        """
+        total = sum(self.samples.values())
+        frames: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames[stack.rsplit(";", 1)[-1]] += count
+        return [(frame, count / total) for frame, count in frames.most_common(limit)]
+
+
+class MemoryProfiler:
+    """Takes tracemalloc snapshots and compares each to the previous one
+
+    Args:
+        frames (int): Frames kept per allocation traceback
+    """
+
+    def __init__(self, frames: int = 10) -> None:
+        self.frames = frames
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    def snapshot(self, directory: str, limit: int = 5) -> Tuple[str, List[str]]:
+        """Dump a snapshot and report what grew since the last one
+
+        The first call starts tracing, which only sees allocations made from
+        then on, so take a second snapshot after some traffic.
+
+        Args:
+            directory (str): Directory of the output file
+            limit (int): Number of lines reported
+
+        Returns:
+            Tuple[str, List[str]]: Path of the snapshot, which
+                tracemalloc.Snapshot.load reads, and the lines that grew or
+                allocate the most
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        path = _output_path(directory, "memory", "snapshot")
+        snapshot.dump(path)
+
+        if self._previous is None:
+            stats = [str(stat) for stat in snapshot.statistics("lineno")[:limit]]
+        else:
+            stats = [
+                str(stat)
+                for stat in snapshot.compare_to(self._previous, "lineno")[:limit]
+            ]
+        self._previous = snapshot
+        return path, stats
+
+    def stop(self) -> None:
+        """Stop tracing, which costs memory and time while it runs"""
+        tracemalloc.stop()
+        self._previous = None
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Keeps the "Executing ... took ... seconds" warnings of asyncio"""
+
+    def __init__(self, warnings: Deque[str]) -> None:
+        super().__init__(logging.WARNING)
+        self.warnings = warnings
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if message.startswith("Executing"):
+            self.warnings.append(f"{time.strftime('%H:%M:%S')} {message}")
+
+
+class LoopMonitor:
+    """Measures event-loop lag and collects slow-callback warnings
+
+    Lag is how late a sleep of ``interval`` seconds wakes up, i.e. how long
+    the loop was blocked. Slow callbacks are only reported while asyncio's
+    debug mode is on, which adds overhead, so it is turned on on demand.
+
+    Args:
+        interval (float): Seconds between two lag measurements
+        slow_callback (float): Seconds after which a callback counts as slow
+        on_lag (Optional[Callable[[float], None]]): Receives every measurement
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        slow_callback: float = 0.1,
+        on_lag: Optional[Callable[[float], None]] = None,
+    ) -> None:
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.lags: Deque[float] = deque(maxlen=120)
+        self.slow_callbacks: Deque[str] = deque(maxlen=20)
+        self._handler = _SlowCallbackHandler(self.slow_callbacks)
+        self._task: Optional[asyncio.Task] = None
+        self.on_lag = on_lag
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            if self.on_lag is not None:
+                self.on_lag(lag)
+
+    def start(self) -> None:
+        """Start measuring on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def set_debug(self, enabled: bool) -> None:
+        """Turn slow-callback reporting on or off"""
+        loop = asyncio.get_running_loop()
+        loop.slow_callback_duration = self.slow_callback
+        loop.set_debug(enabled)
+        asyncio_logger = logging.getLogger("asyncio")
+        if enabled:
+            asyncio_logger.addHandler(self._handler)
+        else:
+            asyncio_logger.removeHandler(self._handler)
+
+    def report(self) -> List[str]:
+        """Lag over the last measurements and the recent slow callbacks"""
+        lags = list(self.lags)
+        lines = [
+            f"Loop lag over {len(lags) * self.interval:.0f}s: "
+            f"mean {sum(lags) / len(lags) * 1000 if lags else 0:.1f}ms, "
+            f"max {max(lags, default=0) * 1000:.1f}ms",
+            f"Debug mode: {'on' if asyncio.get_running_loop().get_debug() else 'off'}",
+        ]
+        lines += list(self.slow_callbacks) or ["No slow callbacks recorded"]
+        return lines
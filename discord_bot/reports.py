@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from chatbot.metrics import ERRORS, STAGE_SECONDS
+from discord_bot import memory
+from discord_bot.parameters import REPORT_QUEUE_SIZE, REPORT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Writes the report of a user from their records, e.g. a bound
+# chatbot.chat.write_doctor_report
+Writer = Callable[[dict, dict, list, str], Awaitable[str]]
+
+
+class ReportQueue:
+    """Generates doctor reports in the background with a bounded worker pool
+
+    Users wait in a bounded queue, at most once each: a user whose report
+    is already waiting is not queued again, the worker reads their records
+    when it gets to them, so the report covers every change made in the
+    meantime. A user submitted while their report is being written is only
+    queued again once it is stored, so two workers never write the report
+    of the same user and an older report never overwrites a newer one.
+
+    Args:
+        writer (Writer): Writes a report from the user data, the medical
+            data, the chat turns and the summary
+        workers (int): Reports generated concurrently
+        max_pending (int): Users that may wait, more are dropped until
+            there is room
+    """
+
+    def __init__(
+        self,
+        writer: Writer,
+        workers: int = REPORT_WORKERS,
+        max_pending: int = REPORT_QUEUE_SIZE,
+    ) -> None:
+        self.writer = writer
+        self.workers = workers
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue(max_pending)
+        # Channel of the conversation of each waiting user
+        self._pending: Dict[int, Optional[int]] = {}
+        # Users whose report is being written
+        self._running: Set[int] = set()
+        # Channel of the users submitted again while their report is written
+        self._rerun: Dict[int, Optional[int]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.generated = 0
+        self.dropped = 0
+
+    def submit(self, user_id: int, channel_id: Optional[int] = None) -> bool:
+        """Queue the report of a user, unless it is waiting already
+
+        Args:
+            user_id (int): ID of the user
+            channel_id (Optional[int]): Channel of the conversation
+
+        Returns:
+            bool: Whether the report is waiting, False if the queue is full
+        """
+        if user_id in self._pending:
+            self._pending[user_id] = channel_id
+            return True
+        if user_id in self._running:
+            self._rerun[user_id] = channel_id  # Queued once the report is stored
+            return True
+        return self._enqueue(user_id, channel_id)
+
+    def _enqueue(self, user_id: int, channel_id: Optional[int]) -> bool:
+        try:
+            self._queue.put_nowait(user_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Report queue full, dropped the report of %s", user_id)
+            return False
+        self._pending[user_id] = channel_id
+        return True
+
+    def pending(self, user_id: int) -> bool:
+        """Whether the report of a user is waiting to be generated"""
+        return user_id in self._pending or user_id in self._rerun
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    async def _generate(self, user_id: int, channel_id: Optional[int]) -> None:
+        medical_data = memory.get_medical_data(user_id)
+        with STAGE_SECONDS.time(stage="report"):
+            report = await self.writer(
+                memory.get_user_data(user_id),
+                medical_data,
+                memory.get_user_chat_history(user_id, channel_id),
+                memory.get_conversation_summary(user_id),
+            )
+        memory.update_doctor_report(
+            user_id,
+            {
+                "report": report,
+                "diagnosed_with": medical_data.get("diagnosed_with", ""),
+                "generated_at": time.time(),
+            },
+        )
+        self.generated += 1
+
+    async def _work(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            # Changes from here on queue a fresh report
+            channel_id = self._pending.pop(user_id, None)
+            self._running.add(user_id)
+            try:
+                await self._generate(user_id, channel_id)
+            except Exception:
+                ERRORS.inc(stage="report")
+                logger.exception("Writing the report of %s failed", user_id)
+            finally:
+                self._running.discard(user_id)
+                if user_id in self._rerun:
+                    self._enqueue(user_id, self._rerun.pop(user_id))
+                self._queue.task_done()
+
+    def start(self) -> None:
+        """Start the workers on the running loop"""
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def join(self) -> None:
+        """Wait until every waiting report has been generated"""
+        await self._queue.join()
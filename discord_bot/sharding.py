@@ -0,0 +1,55 @@
+import multiprocessing
+from typing import Callable, List, Optional
+
+
+def shard_groups(shard_count: int, processes: int) -> List[List[int]]:
+    """Spread shard IDs over worker processes, round-robin
+
+    Args:
+        shard_count (int): Total number of shards
+        processes (int): Number of worker processes
+
+    Returns:
+        List[List[int]]: The shard IDs of each process, empty processes left out
+    """
+    groups = [list(range(shard_count))[i::processes] for i in range(processes)]
+    return [group for group in groups if group]
+
+
+def run_sharded(
+    target: Callable[[Optional[List[int]], Optional[int]], None],
+    shard_count: int,
+    processes: int,
+) -> None:
+    """Run the bot's shards in several processes and wait for them
+
+    Each process runs ``target(shard_ids, shard_count)`` with its own event
+    loop, so CPU-bound work in one process does not delay the others.
+
+    Args:
+        target (Callable): Runs the bot for the given shards, must be picklable
+        shard_count (int): Total number of shards, at least ``processes``
+        processes (int): Number of worker processes
+    """
+    if shard_count < processes:
+        raise ValueError(
+            f"SHARD_COUNT ({shard_count}) must be at least SHARD_PROCESSES ({processes})"
+        )
+
+    context = multiprocessing.get_context("spawn")  # No event loop state is inherited
+    workers = [
+        context.Process(
+            target=target, args=(group, shard_count), name=f"shards-{group[0]}"
+        )
+        for group in shard_groups(shard_count, processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
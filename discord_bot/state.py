@@ -1,48 +1,306 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
 from enum import Enum
+from typing import Any, Dict, Iterator, Optional, Set
 
-from discord_bot.memory import active_users
+from chatbot.metrics import SESSIONS_EXPIRED
+from discord_bot import memory
+from discord_bot.parameters import MAX_SESSIONS, SESSION_IDLE_TTL, SESSION_OFFLOAD
 
+logger = logging.getLogger(__name__)
 
-class BotState(Enum):
-    """A class to represent the state of the bot
+
+class Phase(Enum):
+    """The phases of a conversation with a user"""
+
+    ONBOARDING = "onboarding"  # Collecting the user's personal details
+    TRIAGE = "triage"  # Asking about the symptoms
+    AWAITING_DOCTOR = "awaiting_doctor"  # Diagnosed, handed over to a doctor
+    CLOSED = "closed"  # Ended, the user has to mention the bot again
+
+
+# Phases each phase may move to, staying in the same phase is always allowed
+TRANSITIONS: Dict[Phase, Set[Phase]] = {
+    Phase.ONBOARDING: {Phase.TRIAGE, Phase.CLOSED},
+    Phase.TRIAGE: {Phase.AWAITING_DOCTOR, Phase.CLOSED},
+    Phase.AWAITING_DOCTOR: {Phase.TRIAGE, Phase.CLOSED},
+    Phase.CLOSED: set(),
+}
+
+
+class InvalidTransition(ValueError):
+    """Raised when a session is moved to a phase its phase does not lead to"""
+
+
+class Session:
+    """The conversation of one user
 
     Args:
-        Enum (int): The state of the bot
+        user_id (int): ID of the user
+        channel_id (int): Channel the conversation started in
+        phase (Phase): Current phase
     """
 
-    IDLE = 1
-    ENGAGED = 2
+    def __init__(
+        self, user_id: int, channel_id: int, phase: Phase = Phase.ONBOARDING
+    ) -> None:
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.phase = phase
+        self.last_active = time.time()
+
+    @property
+    def closed(self) -> bool:
+        return self.phase == Phase.CLOSED
+
+    def advance(self, phase: Phase) -> None:
+        """Move to another phase
+
+        Args:
+            phase (Phase): The new phase
 
+        Raises:
+            InvalidTransition: If the transition table does not allow it
+        """
+        if phase != self.phase and phase not in TRANSITIONS[self.phase]:
+            raise InvalidTransition(f"{self.phase.value} -> {phase.value}")
+        self.phase = phase
+        self.last_active = time.time()
 
-def empty_active_users(state_variable: BotState) -> BotState:
-    """Sets state to Idle if the active_users is empty
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "channel_id": self.channel_id,
+            "phase": self.phase.value,
+            "last_active": self.last_active,
+        }
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "Session":
+        session = cls(record["user_id"], record["channel_id"], Phase(record["phase"]))
+        session.last_active = record["last_active"]
+        return session
+
+
+def initial_phase(user_data: Dict[str, Any], medical_data: Dict[str, Any]) -> Phase:
+    """Phase a new conversation starts in, given what is known of the user
 
     Args:
-        state_variable (BotState): The current state of the bot
+        user_data (Dict[str, Any]): Personal details kept from earlier
+        medical_data (Dict[str, Any]): Diagnosis kept from earlier
 
     Returns:
-        BotState: The new state of the bot
+        Phase: The phase
     """
-    if state_variable == BotState.ENGAGED:
-        if not active_users:  # If active_users is empty
-            return BotState.IDLE
+    if not user_data:
+        return Phase.ONBOARDING
+    complete = medical_data.get("diagnose_complete") == "yes"
+    if complete and medical_data.get("diagnosed_with"):
+        return Phase.AWAITING_DOCTOR
+    return Phase.TRIAGE
 
-    return state_variable
 
+class SessionRegistry:
+    """The open sessions, indexed by user ID
 
-def new_user() -> BotState:
-    """Sets state to Engaged when a new Conversation with a user starts
+    Sessions are written through to the storage backend, so they survive a
+    restart with a durable backend. When the store is shared between
+    processes every lookup reads the backend, another process may have
+    changed the session. Otherwise the backend is only read for users
+    whose session is not in memory, and users found without a session are
+    remembered, so messages of users who never started a conversation do
+    not reach the backend again.
 
-    Returns:
-        BotState: The new state of the bot
+    Sessions are kept in order of last activity. ``sweep`` expires the ones
+    idle for longer than ``idle_ttl`` and the least recently active one is
+    evicted once there are more than ``max_sessions``. With ``offload`` and
+    a durable backend, the user's records are only moved out of memory and
+    the conversation resumes where it stopped when the user returns,
+    otherwise the conversation is dropped and the session ends. The
+    personal details, the medical record and the doctor report are kept
+    either way.
+
+    Args:
+        idle_ttl (float): Seconds of inactivity before a session expires, 0
+            keeps idle sessions
+        max_sessions (int): Sessions kept in memory, 0 for no limit
+        offload (bool): Whether expired sessions are offloaded to the backend
     """
-    return BotState.ENGAGED
 
+    def __init__(
+        self,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_sessions: int = MAX_SESSIONS,
+        offload: bool = SESSION_OFFLOAD,
+    ) -> None:
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.offload = offload
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        # Users known to have no stored session, most recent last
+        self._missing: "OrderedDict[int, None]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
 
-def user_exists() -> BotState:
-    """Sets state to Engaged when a user already exists in the active_users list
+    def _remember(self, session: Session) -> None:
+        """Mark a session as the most recently active one"""
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while self.max_sessions and len(self._sessions) > self.max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            self._expire(evicted, "evicted")
 
-    Returns:
-        BotState: The new state of the bot
-    """
-    return BotState.ENGAGED
+    def _miss(self, user_id: int) -> None:
+        """Remember that a user has no stored session"""
+        self._missing[user_id] = None
+        self._missing.move_to_end(user_id)
+        while self.max_sessions and len(self._missing) > self.max_sessions:
+            self._missing.popitem(last=False)
+
+    def _expire(self, session: Session, reason: str) -> None:
+        """Offload a session that left the registry, or drop its conversation"""
+        if memory.store.shared or (self.offload and memory.store.backend.durable):
+            memory.offload_user(session.user_id)
+        else:
+            session.advance(Phase.CLOSED)  # Turns still in flight see it
+            memory.forget_user(session.user_id)
+            self._miss(session.user_id)
+        SESSIONS_EXPIRED.inc(reason=reason)
+
+    def get(self, user_id: int) -> Optional[Session]:
+        """The open session of a user
+
+        Args:
+            user_id (int): ID of the user
+
+        Returns:
+            Optional[Session]: The session, None if the user has none
+        """
+        session = None if memory.store.shared else self._sessions.get(user_id)
+        if session is None:
+            if not memory.store.shared and user_id in self._missing:
+                return None
+            # Offloaded, stored before a restart, or changed by another process
+            record = memory.get_session_record(user_id)
+            if record is None:
+                self._sessions.pop(user_id, None)
+                self._miss(user_id)
+                return None
+            session = Session.from_dict(record)
+        session.last_active = time.time()
+        self._remember(session)
+        return session
+
+    def start(self, user_id: int, channel_id: int, phase: Phase) -> Session:
+        """Open a session for a user
+
+        Args:
+            user_id (int): ID of the user
+            channel_id (int): Channel the conversation starts in
+            phase (Phase): Phase the conversation starts in
+
+        Returns:
+            Session: The new session
+        """
+        session = Session(user_id, channel_id, phase)
+        self._missing.pop(user_id, None)
+        self._remember(session)
+        memory.update_session_record(user_id, session.to_dict())
+        return session
+
+    def refresh(self, session: Session) -> Optional[Session]:
+        """The current state of a session captured earlier
+
+        A turn holds on to the session it started with, meanwhile the
+        conversation may have been ended, by another process too, or the
+        session offloaded and loaded again as another object.
+
+        Args:
+            session (Session): The session as the turn saw it
+
+        Returns:
+            Optional[Session]: The open session of the user, None once the
+            conversation ended
+        """
+        current = None if session.closed else self.get(session.user_id)
+        if current is None:
+            if not session.closed:
+                session.advance(Phase.CLOSED)
+            return None
+        return current
+
+    def advance(self, session: Session, phase: Phase) -> None:
+        """Move a session to another phase and persist it
+
+        Args:
+            session (Session): The session
+            phase (Phase): The new phase
+        """
+        session.advance(phase)
+        if session.closed:
+            self.close(session.user_id)
+        else:
+            self._remember(session)
+            memory.update_session_record(session.user_id, session.to_dict())
+
+    def close(self, user_id: int) -> None:
+        """End the session of a user, if any
+
+        Args:
+            user_id (int): ID of the user
+        """
+        session = self._sessions.pop(user_id, None)
+        if session is not None and not session.closed:
+            session.advance(Phase.CLOSED)  # Turns still in flight see it
+        memory.clear_session_record(user_id)
+        self._miss(user_id)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Expire the sessions idle for longer than the TTL
+
+        Args:
+            now (Optional[float]): Current time, time.time() by default
+
+        Returns:
+            int: Number of expired sessions
+        """
+        if self.idle_ttl <= 0:
+            return 0
+        deadline = (now if now is not None else time.time()) - self.idle_ttl
+        expired = 0
+        # Oldest activity first, so the sweep stops at the first active session
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_active > deadline:
+                break
+            self._sessions.popitem(last=False)
+            self._expire(session, "idle")
+            expired += 1
+        return expired
+
+    async def _sweep_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            expired = self.sweep()
+            if expired:
+                logger.info("Expired %d idle sessions, %d left", expired, len(self))
+
+    def start_sweeper(self, interval: float) -> None:
+        """Sweep for idle sessions every ``interval`` seconds on the running loop
+
+        Args:
+            interval (float): Seconds between two sweeps
+        """
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(list(self._sessions.values()))
+
+
+# The sessions of this process
+sessions = SessionRegistry()
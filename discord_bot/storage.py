@@ -0,0 +1,267 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A pending write: (namespace, key, value), a value of None deletes the record
+Write = Tuple[str, str, Optional[Any]]
+
+
+class StorageBackend:
+    """Interface of the durable stores behind discord_bot.memory
+
+    Records are JSON-serializable values addressed by a namespace such as
+    "user" or "medical" and a key, usually the Discord user ID.
+    """
+
+    # Whether records survive a restart, i.e. whether the cache may drop them
+    durable = True
+
+    def load(self, namespace: str, key: str) -> Optional[Any]:
+        """Load a record, None if it does not exist"""
+        raise NotImplementedError
+
+    def save_many(self, writes: List[Write]) -> None:
+        """Persist a batch of writes in one transaction"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the resources held by the backend"""
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps nothing outside the cache, the behaviour of the plain dicts"""
+
+    durable = False
+
+    def load(self, namespace: str, key: str) -> Optional[Any]:
+        return None
+
+    def save_many(self, writes: List[Write]) -> None:
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores records as JSON in a SQLite database running in WAL mode
+
+    WAL lets the event loop read while the background flusher writes, and a
+    whole batch of writes costs a single fsync.
+
+    Args:
+        path (str): Path of the database file
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader = self._connect()
+        self._writer = self._connect()
+        self._writer.execute(
+            """CREATE TABLE IF NOT EXISTS records (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        self._writer.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def load(self, namespace: str, key: str) -> Optional[Any]:
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT value FROM records WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, writes: List[Write]) -> None:
+        now = time.time()
+        upserts = [
+            (namespace, key, json.dumps(value), now)
+            for namespace, key, value in writes
+            if value is not None
+        ]
+        deletes = [
+            (namespace, key) for namespace, key, value in writes if value is None
+        ]
+        with self._write_lock, self._writer:
+            self._writer.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", upserts
+            )
+            self._writer.executemany(
+                "DELETE FROM records WHERE namespace = ? AND key = ?", deletes
+            )
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+
+class WriteBehindStore:
+    """In-memory hot cache in front of a backend with batched background writes
+
+    Reads are served from the cache and only fall through to the backend on
+    a miss. Writes update the cache immediately and are queued, a daemon
+    thread flushes the queue every ``flush_interval`` seconds so the message
+    handler never waits on the disk. Repeated writes to the same record
+    between two flushes collapse into one.
+
+    Args:
+        backend (StorageBackend): The durable store
+        flush_interval (float): Seconds between two background flushes
+        cache_size (int): Number of records kept in the cache, only enforced
+            for durable backends since evicted records must be reloadable
+        shared (bool): Whether other processes write to the backend too, the
+            cache is then bypassed so their writes are seen once flushed
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        flush_interval: float = 1.0,
+        cache_size: int = 10_000,
+        shared: bool = False,
+    ) -> None:
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.shared = shared
+        self._cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._dirty: Dict[Tuple[str, str], Optional[Any]] = {}
+        self._flushing: Dict[Tuple[str, str], Optional[Any]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, namespace: str, key: Any) -> Optional[Any]:
+        """Get a record from the cache, loading it from the backend on a miss
+
+        Args:
+            namespace (str): Namespace of the record
+            key (Any): Key of the record
+
+        Returns:
+            Optional[Any]: The record, None if it does not exist
+        """
+        cache_key = (namespace, str(key))
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        with self._lock:
+            # Evicted or deleted before its write reached the backend
+            for pending in (self._dirty, self._flushing):
+                if cache_key in pending:
+                    return pending[cache_key]
+
+        value = self.backend.load(*cache_key)
+        if value is not None:
+            self._remember(cache_key, value)
+        return value
+
+    def put(self, namespace: str, key: Any, value: Any) -> None:
+        """Store a record in the cache and queue it for the backend
+
+        Args:
+            namespace (str): Namespace of the record
+            key (Any): Key of the record
+            value (Any): JSON-serializable value
+        """
+        cache_key = (namespace, str(key))
+        self._remember(cache_key, value)
+        if self.backend.durable:
+            with self._lock:
+                self._dirty[cache_key] = value
+
+    def delete(self, namespace: str, key: Any) -> None:
+        """Remove a record from the cache and queue its deletion
+
+        Args:
+            namespace (str): Namespace of the record
+            key (Any): Key of the record
+        """
+        cache_key = (namespace, str(key))
+        self._cache.pop(cache_key, None)
+        if self.backend.durable:
+            with self._lock:
+                self._dirty[cache_key] = None
+
+    def evict(self, namespace: str, key: Any) -> None:
+        """Drop a record from the cache only, it is reloaded on the next get
+
+        Does nothing unless the backend is durable, the cache is the only
+        copy of the record otherwise.
+
+        Args:
+            namespace (str): Namespace of the record
+            key (Any): Key of the record
+        """
+        if self.backend.durable:
+            self._cache.pop((namespace, str(key)), None)
+
+    def _remember(self, cache_key: Tuple[str, str], value: Any) -> None:
+        if self.shared:
+            return  # Another process may change the record at any time
+        self._cache[cache_key] = value
+        self._cache.move_to_end(cache_key)
+        if self.backend.durable:
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def flush(self) -> None:
+        """Write every queued change to the backend in one batch"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flushing = dirty
+        if not dirty:
+            return
+        try:
+            self.backend.save_many(
+                [(namespace, key, value) for (namespace, key), value in dirty.items()]
+            )
+        except Exception:
+            # Requeue the batch unless a newer write replaced it meanwhile
+            with self._lock:
+                for cache_key, value in dirty.items():
+                    self._dirty.setdefault(cache_key, value)
+            raise
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Storage flush failed, retrying: %s", e)
+
+    def start(self) -> None:
+        """Start the background flusher"""
+        if self._thread is None and self.backend.durable:
+            self._thread = threading.Thread(
+                target=self._run, name="storage-flusher", daemon=True
+            )
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background flusher, flush pending writes and close the backend"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.backend.close()
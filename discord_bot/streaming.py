@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Set
+
+import discord
+
+from discord_bot.parameters import STREAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+
+class StreamingReply:
+    """A reply message that is edited progressively while it is generated
+
+    Edits are throttled to one per ``interval`` seconds per channel, the
+    replies streaming in the same channel share it, and run in the
+    background, so consuming the completion stream never waits on Discord.
+    Text that arrives while an edit is in flight or throttled is not lost,
+    the next edit or ``finish`` sends the latest version.
+
+    Args:
+        channel (discord.abc.Messageable): The channel to reply in
+        prefix (str): Text put in front of every version, e.g. a mention
+        interval (float): Minimum seconds between two edits in the channel
+    """
+
+    # Time of the latest edit in each channel, oldest first, only as long
+    # as it still throttles the channel
+    _channel_edits: "OrderedDict[Hashable, float]" = OrderedDict()
+    # Deletions nobody awaits, referenced until they are done
+    _cleanups: Set[asyncio.Task] = set()
+
+    def __init__(
+        self,
+        channel: discord.abc.Messageable,
+        prefix: str = "",
+        interval: float = STREAM_EDIT_INTERVAL,
+    ) -> None:
+        self.channel = channel
+        self.prefix = prefix
+        self.interval = interval
+        self.message: Optional[discord.Message] = None
+        self._text = ""
+        self._sent_text = ""
+        self._last_edit = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+        self._channel_key = getattr(channel, "id", id(channel))
+
+    async def start(self, placeholder: str = "...") -> None:
+        """Post the placeholder message that is edited later
+
+        Args:
+            placeholder (str): Text shown until the first tokens arrive
+        """
+        self.message = await self.channel.send(self._render(placeholder))
+        self._last_edit = time.monotonic()
+
+    def _render(self, text: str) -> str:
+        return (self.prefix + text)[:MESSAGE_LIMIT]
+
+    def _record_edit(self, now: float) -> None:
+        """Note an edit in the channel, forgetting edits that no longer count"""
+        edits = self._channel_edits
+        edits[self._channel_key] = now
+        edits.move_to_end(self._channel_key)
+        while edits and now - next(iter(edits.values())) >= self.interval:
+            edits.popitem(last=False)
+
+    async def _edit(self, text: str) -> None:
+        self._sent_text = text
+        self._last_edit = time.monotonic()
+        self._record_edit(self._last_edit)
+        await self.message.edit(content=self._render(text))
+
+    async def update(self, text: str) -> None:
+        """Show a newer version of the reply if the throttle allows it
+
+        Args:
+            text (str): The reply generated so far
+        """
+        self._text = text
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        now = time.monotonic()
+        channel_edit = self._channel_edits.get(self._channel_key, 0.0)
+        if now - max(self._last_edit, channel_edit) < self.interval:
+            return
+        # Take the channel's slot now, before another reply checks it
+        self._record_edit(now)
+        self._edit_task = asyncio.create_task(self._edit(text))
+
+    async def discard(self) -> None:
+        """Delete the message, e.g. when a newer request supersedes this reply"""
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+        if self.message is not None:
+            try:
+                await self.message.delete()
+            except discord.HTTPException as e:
+                logger.warning("Deleting a streamed reply failed: %s", e)
+
+    def discard_soon(self) -> None:
+        """Delete the message in the background, e.g. from a cancelled task"""
+        task = asyncio.create_task(self.discard())
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    async def fail(self, text: str) -> None:
+        """Replace the partial reply with an error message, or delete it
+
+        Args:
+            text (str): The error message
+        """
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+        if self.message is None:
+            return
+        try:
+            await self._edit(text)
+        except discord.HTTPException:
+            await self.discard()
+
+    async def finish(self, text: str) -> None:
+        """Show the final reply
+
+        Args:
+            text (str): The complete reply
+        """
+        if self._edit_task is not None:
+            await self._edit_task
+        if text != self._sent_text:
+            await self._edit(text)
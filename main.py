@@ -1,11 +1,40 @@
+import logging
 import os
+from typing import List, Optional
 from dotenv import load_dotenv
+
+# Load environment variables from .env file, before the project modules
+# read their settings on import
+load_dotenv()
+
 from discord_bot.bot import create_bot
-from openai import AzureOpenAI
+from discord_bot.memory import close_storage, configure_storage
+from discord_bot.parameters import (
+    LOG_LEVEL,
+    LOG_PAYLOADS,
+    METRICS_HOST,
+    METRICS_PORT,
+    SHARD_COUNT,
+    SHARD_PROCESSES,
+    SQLITE_DB_FILE,
+    STORAGE_BACKEND,
+)
+from discord_bot.sharding import run_sharded
+from discord_bot.storage import SQLiteBackend
+from openai import AsyncAzureOpenAI
 from chatbot.chat import hello
+from chatbot.logs import configure_logging
+from chatbot.metrics import start_http_server
+from chatbot.parameters import (
+    AZURE_FAILOVER_COOLDOWN,
+    AZURE_OPENAI_API_VERSION,
+    AZURE_OPENAI_DEPLOYMENTS,
+    AZURE_REQUEST_TIMEOUT,
+)
+from chatbot.pool import ClientPool
 
-# Load environment variables from .env file
-load_dotenv()
+configure_logging(LOG_LEVEL, LOG_PAYLOADS)
+logger = logging.getLogger(__name__)
 
 # Get the Discord token from environment variables
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
@@ -20,18 +49,91 @@ if not DISCORD_TOKEN:
         "No Discord token found. Please set DISCORD_TOKEN in your .env file"
     )
 
-if not all([AZURE_API_KEY, AZURE_API_ENDPOINT]):
-    print("⚠️ Missing Azure OpenAI credentials in .env file.")
-    raise ValueError("No Azure OpenAI credentials in .env file.")
 
-openai_client = AzureOpenAI(
-    api_key=AZURE_API_KEY,
-    azure_endpoint=AZURE_API_ENDPOINT,
-)
+def create_openai_client():
+    """Create the Azure OpenAI client, a pool when several deployments are set
+
+    Returns:
+        AsyncAzureOpenAI | ClientPool: The client
+    """
+    if AZURE_OPENAI_DEPLOYMENTS:
+        # Load balance over several deployments and fail over between them
+        pool = ClientPool.from_config(
+            AZURE_OPENAI_DEPLOYMENTS,
+            api_version=AZURE_OPENAI_API_VERSION,
+            cooldown=AZURE_FAILOVER_COOLDOWN,
+            timeout=AZURE_REQUEST_TIMEOUT,
+        )
+        logger.info(
+            "Azure OpenAI client: pool of %d deployments (%s), timeout %ss, "
+            "cooldown %ss",
+            len(pool.deployments),
+            ", ".join(f"{d.name}: {d.model}" for d in pool.deployments),
+            AZURE_REQUEST_TIMEOUT,
+            AZURE_FAILOVER_COOLDOWN,
+        )
+        return pool
+
+    if not all([AZURE_API_KEY, AZURE_API_ENDPOINT]):
+        print("⚠️ Missing Azure OpenAI credentials in .env file.")
+        raise ValueError("No Azure OpenAI credentials in .env file.")
+
+    logger.info(
+        "Azure OpenAI client: single endpoint %s, AZURE_OPENAI_DEPLOYMENTS "
+        "is not set",
+        AZURE_API_ENDPOINT,
+    )
+    return AsyncAzureOpenAI(
+        api_key=AZURE_API_KEY,
+        azure_endpoint=AZURE_API_ENDPOINT,
+        api_version=AZURE_OPENAI_API_VERSION,
+        max_retries=0,  # 429s are retried by the request scheduler
+    )
+
+
+def run_bot(
+    shard_ids: Optional[List[int]] = None, shard_count: Optional[int] = None
+) -> None:
+    """Run the bot for some or all of its shards until it disconnects
+
+    Args:
+        shard_ids (Optional[List[int]]): Shards to run, all of them when None
+        shard_count (Optional[int]): Total number of shards
+    """
+    openai_client = create_openai_client()
+
+    if METRICS_PORT:
+        # Shard groups start at shard 0, 1, 2... one port per worker process
+        start_http_server(METRICS_PORT + (shard_ids[0] if shard_ids else 0), METRICS_HOST)
+
+    # Persist user and medical data across restarts, and share it between
+    # the processes of a sharded bot
+    if STORAGE_BACKEND == "sqlite":
+        configure_storage(
+            SQLiteBackend(SQLITE_DB_FILE), shared=SHARD_PROCESSES > 1
+        )
+    else:
+        logger.warning(
+            "STORAGE_BACKEND=%s is not durable: the records of every user stay "
+            "in memory, memory grows with the number of users until a restart",
+            STORAGE_BACKEND,
+        )
+
+    # Create and run the bot
+    bot = create_bot(openai_client, shard_ids, shard_count or None)
+    try:
+        bot.run(DISCORD_TOKEN)
+    finally:
+        close_storage()  # Flush the writes that are still queued
+
 
-# Create and run the bot
-bot = create_bot(openai_client)
-bot.run(DISCORD_TOKEN)
+if __name__ == "__main__":
+    if SHARD_PROCESSES > 1:
+        if STORAGE_BACKEND != "sqlite":
+            raise ValueError("SHARD_PROCESSES > 1 requires STORAGE_BACKEND=sqlite")
+        run_sharded(run_bot, SHARD_COUNT, SHARD_PROCESSES)
+    else:
+        run_bot(shard_count=SHARD_COUNT or None)
 
 
-# response = hello(client)
+# response = asyncio.run(hello(openai_client))
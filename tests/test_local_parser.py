@@ -0,0 +1,67 @@
+import pytest
+
+from chatbot.local_parser import parse_personal_details
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ("I'm Mani, 21 Male", {"Name": "Mani", "Age": "21", "Gender": "Male"}),
+        ("I am Priya 29 female", {"Name": "Priya", "Age": "29", "Gender": "Female"}),
+        ("My name is ravi, 34", {"Name": "Ravi", "Age": "34"}),
+        ("Female, 45", {"Gender": "Female", "Age": "45"}),
+        ("21M", {"Age": "21", "Gender": "Male"}),
+        ("I'm 30 years old", {"Age": "30"}),
+        ("age: 52", {"Age": "52"}),
+        (
+            "I'm Mani, 21 Male, mobile +91 98765 43210",
+            {"Name": "Mani", "Age": "21", "Gender": "Male", "Mobile": "+919876543210"},
+        ),
+    ],
+)
+def test_details_only(message, expected):
+    assert parse_personal_details(message) == (expected, "")
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "I'm Mani. I have 2 kids",
+        "I'm Mani and I have had a fever for 3 days",
+        "Male nurse here, I work 12 hour shifts",
+        "I'm Mani, my 2 sons are sick",
+    ],
+)
+def test_unrelated_number_is_not_an_age(message):
+    data, remainder = parse_personal_details(message)
+    assert "Age" not in data
+    assert remainder  # Left to the model
+
+
+def test_number_next_to_the_name_and_another_one():
+    data, _ = parse_personal_details("I'm Mani, 21, and I have 2 kids")
+    assert data == {"Name": "Mani", "Age": "21"}
+
+
+def test_implausible_age():
+    data, _ = parse_personal_details("I'm Mani, 150 Male")
+    assert data == {"Name": "Mani", "Gender": "Male"}
+
+
+def test_phone_digits_are_not_an_age():
+    data, _ = parse_personal_details("Male, 9876543210")
+    assert data == {"Gender": "Male", "Mobile": "9876543210"}
+
+
+def test_not_a_name():
+    data, remainder = parse_personal_details("I'm Feeling sick")
+    assert data == {}
+    assert remainder == "Feeling sick"
+
+
+def test_work_details_remain():
+    data, remainder = parse_personal_details(
+        "I'm Mani, 21 Male. i'm currently working as a developer at Aegion."
+    )
+    assert data == {"Name": "Mani", "Age": "21", "Gender": "Male"}
+    assert remainder == "currently working as developer at Aegion"